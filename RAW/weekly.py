@@ -3,48 +3,62 @@ import sys
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from PIL import Image, ImageTk
-import pandas as pd
-import glob
+import io
+import queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
 import openpyxl
 from openpyxl.drawing.image import Image as OpenpyxlImage
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
 
 if getattr(sys, 'frozen', False):
-    APP_ROOT = sys._MEIPASS
+    # Frozen, weekly keeps reading the data bundled with it rather than all2's D:\allinone; the history
+    # built from it is kept in the per-user cache, outside the bundle
+    os.environ.setdefault('ALLINONE_ROOT', sys._MEIPASS)
 else:
-    APP_ROOT = os.path.abspath(os.path.dirname(__file__))
-SALES_DIR = os.path.join(APP_ROOT, 'sales data')
-IMAGE_DIR = os.path.join(APP_ROOT, 'images')
-LOGO_PATH = os.path.join(APP_ROOT, 'Lazera Logo-02.png')
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_engine import DataEngine, LOGO_PATH, WEEKS as ENGINE_WEEKS, find_image_path
+from export_jobs import JobQueue, JobPanel, no_progress
+from pdf_export import EXPORT_WORKERS, VectorPdfWriter, figure_pdf, thumbnail_png
 IMAGE_DISPLAY_SIZE = (100, 100)
 FONT = ("Segoe UI", 10)
 HEADER_FONT = ("Segoe UI", 10, "bold")
-
-def get_latest_files(directory, pattern, count=5):
-    files = glob.glob(os.path.join(directory, pattern))
-    if 'salesdata' in pattern.lower():
-        def get_num(p):
-            name = os.path.basename(p)
-            num = ''.join(filter(str.isdigit, name))
-            return int(num) if num.isdigit() else -1
-        files = [f for f in files if 'salesdata' in os.path.basename(f).lower()]
-        files.sort(key=get_num)
-    else:
-        files.sort(key=os.path.getmtime)
-    return files[-count:]
-
-def load_sales_data():
-    frames = []
-    for i, path in enumerate(get_latest_files(SALES_DIR, 'salesdata*.xlsx', 5), 1):
-        df = pd.read_excel(path)
-        df.columns = df.columns.str.lower().str.replace(' ', '_')
-        df.rename(columns={'colour':'color', 'quantity':'qty'}, inplace=True)
-        if all(c in df.columns for c in ['article','store','color','size','qty','asp']):
-            sub = df[['article','store','color','size','qty','asp']].copy()
-            sub['week'] = f'Week {i}'
-            frames.append(sub)
-    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['article','store','color','size','qty','asp','week'])
+WEEKS = ENGINE_WEEKS[:-1]
+COLUMN_WIDTHS = [160, 120] + [90]*len(WEEKS)
+ROW_HEIGHT = 118
+ROW_BUFFER = 4
+THUMB_CACHE_SIZE = 256
+THUMB_WORKERS = 4
+PDF_GRID = (3, 3)
+PDF_PAGE_SIZE = (11.69, 8.27)
+# Resolution the thumbnails are embedded at, about that of PDF_THUMB_SIZE in a cell; the text is vector
+PDF_DPI = 110
+PDF_THUMB_SIZE = (200, 200)
+
+def write_excel_with_images(df_pivot, articles, file_path, progress=no_progress):
+    # Thumbnails are built in parallel into memory, then the workbook is streamed out in one pass
+    total = 2*len(articles)
+    thumbs = []
+    with ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as pool:
+        for png in pool.map(lambda a: thumbnail_png(a, IMAGE_DISPLAY_SIZE), articles):
+            thumbs.append(png)
+            progress(len(thumbs), total)
+
+    columns = [c for c in df_pivot.columns]
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title="Weekly Sales")
+    ws.column_dimensions['B'].width = IMAGE_DISPLAY_SIZE[0] / 7
+    ws.append([df_pivot.index.name or 'article', 'Image'] + columns)
+    values = df_pivot.reindex(articles)[columns].to_numpy().tolist()
+    for row_idx, (article, row, png) in enumerate(zip(articles, values, thumbs), 2):
+        ws.row_dimensions[row_idx].height = IMAGE_DISPLAY_SIZE[1] * 0.75
+        xl_img = OpenpyxlImage(io.BytesIO(png))
+        xl_img.anchor = f'B{row_idx}'
+        ws.add_image(xl_img)
+        ws.append([article, None] + row)
+        progress(len(articles) + row_idx - 1, total)
+    wb.save(file_path)
 
 def export_to_excel_with_images(app):
     if not hasattr(app, 'df_pivot') or not app.articles:
@@ -55,40 +69,55 @@ def export_to_excel_with_images(app):
     if not file_path:
         return
 
-    # Add a placeholder column for "Image" (for reference)
-    export_df = app.df_pivot.copy()
-    export_df.insert(0, 'Image', 'See image above')
-
-    # Export data to Excel
-    export_df.to_excel(file_path, index=True)
-
-    # Open the Excel file with openpyxl
-    wb = openpyxl.load_workbook(file_path)
-    ws = wb.active
-
-    # Insert images as floating objects
-    for row_idx, article in enumerate(app.articles, 2):  # Start from row 2 (header is row 1)
-        img_path = next((os.path.join(IMAGE_DIR, f"{article}{ext}") for ext in ['.jpg', '.jpeg', '.png'] if os.path.exists(os.path.join(IMAGE_DIR, f"{article}{ext}"))), None)
-        if not img_path:
-            img_path = LOGO_PATH
-
-        img = Image.open(img_path)
-        img.thumbnail(IMAGE_DISPLAY_SIZE)
-        temp_img_path = os.path.join(IMAGE_DIR, f"temp_{article}.png")
-        img.save(temp_img_path, "PNG")  # Save as PNG (required by openpyxl)
-
-        xl_img = OpenpyxlImage(temp_img_path)
-        ws.add_image(xl_img, f'B{row_idx}')  # Place image in column B, current row
-
-        # Clean up
-        if os.path.exists(temp_img_path):
-            os.remove(temp_img_path)
-
-    # Save the workbook
-    wb.save(file_path)
-    messagebox.showinfo("Success", "Data and images exported to Excel successfully!")
-
-def export_to_pdf_with_images(app):
+    df_pivot, articles = app.df_pivot, list(app.articles)
+    app.jobs.submit("Excel export", lambda path, progress: write_excel_with_images(df_pivot, articles, path, progress), file_path)
+
+def render_pdf_page(job):
+    # Runs in a worker process; returns the page as a one-page vector PDF
+    page_no, page_count, items, grid = job
+    cols, rows = grid
+    fig = Figure(figsize=PDF_PAGE_SIZE, dpi=PDF_DPI)
+    fig.text(0.5, 0.975, f"Weekly Sales | Lazera Shoes   (page {page_no}/{page_count})", ha='center', va='top', fontsize=11, weight='bold')
+    cell_w, cell_h = 1/cols, 0.94/rows
+    for i, (article, weeks, total, png) in enumerate(items):
+        r, c = divmod(i, cols)
+        left, bottom = c*cell_w, 0.94 - (r+1)*cell_h
+        img_ax = fig.add_axes([left + 0.01, bottom + 0.02, cell_w*0.42, cell_h*0.9])
+        img_ax.imshow(Image.open(io.BytesIO(png)))
+        img_ax.axis('off')
+        text_x = left + cell_w*0.46
+        fig.text(text_x, bottom + cell_h*0.85, str(article), fontsize=10, weight='bold', va='top')
+        lines = [f"{w}: {q:.0f}" for w, q in zip(WEEKS, weeks)] + [f"Total: {total:.0f}"]
+        fig.text(text_x, bottom + cell_h*0.65, "\n".join(lines), fontsize=8, va='top', linespacing=1.4)
+    return figure_pdf(fig)
+
+def write_pdf_with_images(df_pivot, articles, file_path, grid=PDF_GRID, progress=no_progress):
+    per_page = grid[0]*grid[1]
+    page_count = -(-len(articles) // per_page)
+    total = len(articles) + page_count
+    thumbs = []
+    with ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as pool:
+        for png in pool.map(lambda a: thumbnail_png(a, PDF_THUMB_SIZE), articles):
+            thumbs.append(png)
+            progress(len(thumbs), total)
+    pivot = df_pivot.reindex(articles)
+    weeks = pivot.reindex(columns=WEEKS, fill_value=0).to_numpy().tolist()
+    totals = pivot['Total'].tolist() if 'Total' in pivot.columns else [sum(w) for w in weeks]
+    items = list(zip(articles, weeks, totals, thumbs))
+    pages = [items[i:i+per_page] for i in range(0, len(items), per_page)]
+    jobs = [(n, len(pages), page, grid) for n, page in enumerate(pages, 1)]
+
+    writer = VectorPdfWriter(file_path)
+    pool = ProcessPoolExecutor(max_workers=EXPORT_WORKERS)
+    try:
+        for n, page in enumerate(pool.map(render_pdf_page, jobs), 1):
+            writer.add_page(page)
+            progress(len(articles) + n, total)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        writer.close()
+
+def export_to_pdf_with_images(app, grid=PDF_GRID):
     if not hasattr(app, 'df_pivot') or not app.articles:
         messagebox.showwarning("No Data", "No data to export.")
         return
@@ -97,54 +126,8 @@ def export_to_pdf_with_images(app):
     if not file_path:
         return
 
-    # Prepare data for PDF
-    export_df = app.df_pivot.copy()
-    export_df.insert(0, 'Image', 'See image below')
-
-    with PdfPages(file_path) as pdf:
-        for article in app.articles:
-            # Create a figure for each article
-            fig = plt.figure(figsize=(11, 2))
-            ax = fig.add_subplot(111)
-
-            # Hide axes
-            ax.axis('off')
-
-            # Table data
-            row_data = [[article] + [export_df.loc[article, f'Week {i}'] if f'Week {i}' in export_df.columns else 0 for i in range(1,6)]]
-            col_labels = ['Article'] + [f'Week {i}' for i in range(1,6)]
-
-            # Add table
-            table = ax.table(cellText=row_data, colLabels=col_labels, loc='center')
-            table.auto_set_font_size(False)
-            table.set_fontsize(10)
-            table.scale(1.2, 1.2)
-
-            # Add image
-            img_path = next((os.path.join(IMAGE_DIR, f"{article}{ext}") for ext in ['.jpg', '.jpeg', '.png'] if os.path.exists(os.path.join(IMAGE_DIR, f"{article}{ext}"))), None)
-            if not img_path:
-                img_path = LOGO_PATH
-
-            img = Image.open(img_path)
-            img.thumbnail((200, 200))
-            temp_img_path = os.path.join(IMAGE_DIR, f"temp_{article}_pdf.png")
-            img.save(temp_img_path, "PNG")
-
-            # Place image above or beside table (this is a simple example; adjust as needed)
-            # For a more advanced layout, you might need to use reportlab or borb
-            img_ax = fig.add_axes([0.1, 0.6, 0.3, 0.3])
-            img_ax.imshow(img)
-            img_ax.axis('off')
-
-            # Save page
-            pdf.savefig(fig)
-            plt.close(fig)
-
-            # Clean up
-            if os.path.exists(temp_img_path):
-                os.remove(temp_img_path)
-
-    messagebox.showinfo("Success", "Data and images exported to PDF successfully!")
+    df_pivot, articles = app.df_pivot, list(app.articles)
+    app.jobs.submit("PDF export", lambda path, progress: write_pdf_with_images(df_pivot, articles, path, grid, progress), file_path)
 
 class ArticleSalesApp(tk.Tk):
     def __init__(self):
@@ -154,84 +137,167 @@ class ArticleSalesApp(tk.Tk):
         self.configure(bg="#f0f4f8")
 
         # Data
-        self.df = load_sales_data()
-        self.df_pivot = self._prepare_pivot()
-        self.articles = self._get_sorted_articles()
+        self.engine = DataEngine()
+        self.df_pivot = self.engine.weekly_pivot()
+        self.articles = self.df_pivot.index.tolist()
 
         # UI
         self._build_ui()
 
-    def _prepare_pivot(self):
-        if self.df.empty:
-            return pd.DataFrame()
-        pivot = self.df.pivot_table(index='article', columns='week', values='qty', aggfunc='sum').fillna(0)
-        return pivot
-
-    def _get_sorted_articles(self):
-        if self.df_pivot.empty:
-            return []
-        self.df_pivot['Total'] = self.df_pivot.sum(axis=1)
-        self.df_pivot = self.df_pivot.sort_values('Total', ascending=False)
-        return self.df_pivot.index.unique().tolist()
-
     def _build_ui(self):
         # Top controls
         top = tk.Frame(self, bg="#e3f2fd")
         top.pack(fill='x', padx=10, pady=8)
         tk.Button(top, text="Export to Excel with Images", command=lambda: export_to_excel_with_images(self), bg="#1976d2", fg="white", font=FONT).pack(side='left', padx=5)
         tk.Button(top, text="Export to PDF with Images", command=lambda: export_to_pdf_with_images(self), bg="#f44336", fg="white", font=FONT).pack(side='left', padx=5)
+        self.jobs = JobQueue()
+        JobPanel(top, self.jobs, font=FONT).pack(side='left', padx=10)
+
+        # Table headers (kept outside the canvas so they stay visible)
+        headers = ["Article", "Photo"] + WEEKS
+        header = tk.Frame(self, bg="#bbdefb")
+        header.pack(fill='x', padx=10)
+        for i, h in enumerate(headers):
+            header.grid_columnconfigure(i, minsize=COLUMN_WIDTHS[i], weight=1)
+            tk.Label(header, text=h, font=HEADER_FONT, bg="#bbdefb", padx=10, pady=5).grid(row=0, column=i, sticky="ew")
 
         # Table frame
         table_frame = tk.Frame(self, bg="#e3f2fd")
         table_frame.pack(fill='both', expand=True, padx=10, pady=5)
 
-        # Canvas and scrollbar
-        canvas = tk.Canvas(table_frame, bg="#e3f2fd")
-        scrollbar = ttk.Scrollbar(table_frame, orient="vertical", command=canvas.yview)
-        scrollable_frame = tk.Frame(canvas, bg="#e3f2fd")
-
-        scrollable_frame.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
-        canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
-        canvas.configure(yscrollcommand=scrollbar.set)
-
-        canvas.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
-
-        # Table headers
-        headers = ["Article", "Photo", "Week 1", "Week 2", "Week 3", "Week 4", "Week 5"]
-        for i, h in enumerate(headers):
-            tk.Label(scrollable_frame, text=h, font=HEADER_FONT, bg="#bbdefb", padx=10, pady=5).grid(row=0, column=i, sticky="ew")
-
-        # Table data
-        for row_idx, article in enumerate(self.articles, 1):
-            # Article row frame (for border)
-            row_frame = tk.Frame(scrollable_frame, bg="#e3f2fd", highlightbackground="#999", highlightthickness=3)
-            row_frame.grid(row=row_idx, column=0, columnspan=len(headers), sticky="ew")
-            row_frame.grid_rowconfigure(0, weight=1)
-            for col in range(len(headers)):
-                row_frame.grid_columnconfigure(col, weight=1)
-
-            # Article
-            lbl = tk.Label(row_frame, text=article, font=FONT, bg="#e3f2fd", padx=10, pady=5)
-            lbl.grid(row=0, column=0, sticky="w")
-
-            # Photo
-            img_frame = tk.Frame(row_frame, bg="#e3f2fd")
-            img_frame.grid(row=0, column=1, padx=5, pady=5)
-            img_path = next((os.path.join(IMAGE_DIR, f"{article}{ext}") for ext in ['.jpg', '.jpeg', '.png'] if os.path.exists(os.path.join(IMAGE_DIR, f"{article}{ext}"))), None)
-            img = Image.open(img_path if img_path else LOGO_PATH)
+        # Virtual list: only visible rows (plus a buffer) exist and are recycled while scrolling
+        self.canvas = tk.Canvas(table_frame, bg="#e3f2fd", highlightthickness=0, yscrollincrement=ROW_HEIGHT//4)
+        self.scrollbar = ttk.Scrollbar(table_frame, orient="vertical", command=self.canvas.yview)
+        self.canvas.configure(yscrollcommand=self._on_canvas_scroll, scrollregion=(0, 0, 0, len(self.articles)*ROW_HEIGHT))
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+        self.canvas.bind("<Configure>", self._on_canvas_configure)
+        self.canvas.bind_all("<MouseWheel>", lambda e: self.canvas.yview_scroll(int(-e.delta/120)*4, 'units'))
+        self.canvas.bind_all("<Button-4>", lambda e: self.canvas.yview_scroll(-4, 'units'))
+        self.canvas.bind_all("<Button-5>", lambda e: self.canvas.yview_scroll(4, 'units'))
+
+        self.week_values = self.df_pivot.reindex(columns=WEEKS, fill_value=0).to_numpy() if self.articles else None
+        self.rows = []
+        self.thumbs = OrderedDict()
+        self.thumb_wanted = set()
+        self.thumb_pending = set()
+        self.thumb_queue = queue.Queue()
+        self.thumb_pool = ThreadPoolExecutor(max_workers=THUMB_WORKERS)
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+        self.after(50, self._poll_thumbs)
+
+    def _make_row(self):
+        row_frame = tk.Frame(self.canvas, bg="#e3f2fd", highlightbackground="#999", highlightthickness=3)
+        row_frame.grid_rowconfigure(0, weight=1)
+        for col, width in enumerate(COLUMN_WIDTHS):
+            row_frame.grid_columnconfigure(col, minsize=width, weight=1)
+        article = tk.Label(row_frame, font=FONT, bg="#e3f2fd", padx=10, pady=5)
+        article.grid(row=0, column=0, sticky="w")
+        image = tk.Label(row_frame, bg="#e3f2fd", fg="#1976d2", font=FONT)
+        image.grid(row=0, column=1, padx=5, pady=5)
+        weeks = []
+        for week_idx in range(len(WEEKS)):
+            lbl = tk.Label(row_frame, font=FONT, bg="#e3f2fd", padx=10, pady=5)
+            lbl.grid(row=0, column=week_idx+2, sticky="e")
+            weeks.append(lbl)
+        window = self.canvas.create_window(0, -2*ROW_HEIGHT, window=row_frame, anchor="nw", height=ROW_HEIGHT, width=self.canvas.winfo_width())
+        return {'frame': row_frame, 'article': article, 'image': image, 'weeks': weeks, 'window': window, 'index': None}
+
+    def _bind_row(self, row, index):
+        article = self.articles[index]
+        row['index'] = index
+        row['article'].config(text=article)
+        for lbl, qty in zip(row['weeks'], self.week_values[index]):
+            lbl.config(text=f"{qty:.0f}")
+        photo = self.thumbs.get(article)
+        if photo is not None:
+            self.thumbs.move_to_end(article)
+            row['image'].config(image=photo, text='')
+        else:
+            row['image'].config(image='', text='Loading...')
+            self._request_thumb(article)
+        self.canvas.coords(row['window'], 0, index*ROW_HEIGHT)
+
+    def _refresh_rows(self):
+        if not self.articles:
+            return
+        top = int(self.canvas.canvasy(0)) // ROW_HEIGHT
+        first = max(top - ROW_BUFFER, 0)
+        last = min(top + self.canvas.winfo_height()//ROW_HEIGHT + 1 + ROW_BUFFER, len(self.articles))
+        self.thumb_wanted = set(self.articles[first:last])
+        while len(self.rows) < last - first:
+            self.rows.append(self._make_row())
+        placed = {r['index'] for r in self.rows if r['index'] is not None and first <= r['index'] < last}
+        free = [r for r in self.rows if r['index'] not in placed]
+        for index in range(first, last):
+            if index not in placed:
+                self._bind_row(free.pop(), index)
+        for row in free:
+            row['index'] = None
+            self.canvas.coords(row['window'], 0, -2*ROW_HEIGHT)
+
+    def _on_canvas_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self._refresh_rows()
+
+    def _on_canvas_configure(self, event):
+        for row in self.rows:
+            self.canvas.itemconfigure(row['window'], width=event.width)
+        self._refresh_rows()
+
+    def _request_thumb(self, article):
+        if article in self.thumb_pending:
+            return
+        self.thumb_pending.add(article)
+        self.thumb_pool.submit(self._load_thumb, article)
+
+    def _load_thumb(self, article):
+        # Runs on a worker thread: decode only, PhotoImage creation stays on the Tk thread
+        if article not in self.thumb_wanted:
+            self.thumb_queue.put((article, False))
+            return
+        try:
+            img = Image.open(find_image_path(article) or LOGO_PATH)
             img.thumbnail(IMAGE_DISPLAY_SIZE)
-            img = ImageTk.PhotoImage(img)
-            img_label = tk.Label(img_frame, image=img, bg="#e3f2fd")
-            img_label.image = img
-            img_label.pack()
-
-            # Week sales
-            for week_idx, week in enumerate([f"Week {i}" for i in range(1,6)], 2):
-                qty = self.df_pivot.loc[article, week] if week in self.df_pivot.columns else 0
-                lbl = tk.Label(row_frame, text=f"{qty:.0f}", font=FONT, bg="#e3f2fd", padx=10, pady=5)
-                lbl.grid(row=0, column=week_idx, sticky="e")
+            img.load()
+        except Exception:
+            img = None
+        self.thumb_queue.put((article, img))
+
+    def _poll_thumbs(self):
+        while True:
+            try:
+                article, img = self.thumb_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.thumb_pending.discard(article)
+            visible = [r for r in self.rows if r['index'] is not None and self.articles[r['index']] == article]
+            if img is False:
+                if visible:
+                    self._request_thumb(article)
+                continue
+            if img is None:
+                for row in visible:
+                    row['image'].config(image='', text='No Image')
+                continue
+            photo = ImageTk.PhotoImage(img)
+            self.thumbs[article] = photo
+            while len(self.thumbs) > max(THUMB_CACHE_SIZE, len(self.rows)):
+                self.thumbs.popitem(last=False)
+            for row in visible:
+                row['image'].config(image=photo, text='')
+        self.after(50, self._poll_thumbs)
+
+    def _on_close(self):
+        if self.jobs.busy():
+            if not messagebox.askyesno("Exports Running", "Exports are still running. Cancel them and quit?"):
+                return
+            self.jobs.cancel_all()
+            self.jobs.thread.join(timeout=5)
+        self.thumb_pool.shutdown(wait=False, cancel_futures=True)
+        self.destroy()
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     app = ArticleSalesApp()
     app.mainloop()
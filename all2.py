@@ -1,26 +1,38 @@
 import os
-import sys
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 from PIL import Image, ImageTk
-import pandas as pd
+import numpy as np
 import logging
-import glob
-
-if getattr(sys, 'frozen', False):
-    APP_ROOT = r'D:\allinone'
-else:
-    APP_ROOT = os.path.abspath(os.path.dirname(__file__))
-SALES_DIR = os.path.join(APP_ROOT, 'sales data')
-INVENTORY_DIR = os.path.join(APP_ROOT, 'inventory data')
-PENDING_DIR = os.path.join(APP_ROOT, 'pending orders')
-IMAGE_DIR = os.path.join(APP_ROOT, 'images')
-LOGO_PATH = os.path.join(APP_ROOT, 'Lazera Logo-02.png')
+import time
+from concurrent.futures import ThreadPoolExecutor
+from data_engine import APP_ROOT, LOGO_PATH, WINDOW_CHOICES, find_image_path
+from export_jobs import JobQueue, JobPanel
+from data_watcher import DataWatcher, WATCH_POLL_MS
+from sales_db import SalesDatabase
+from engine_snapshot import load_or_build
+from shared_dataset import attach_or_publish
+from data_server import DataClient, ServerWatcher
+from reports import REPORTS, RECONCILIATION_REPORTS, write_article_breakdowns, write_xlsx
+
 ERROR_LOG_PATH = os.path.join(APP_ROOT, 'app_code', 'error_log.txt')
 MRP_FIXED = 0000
-WEEKS = [f'Week {i}' for i in range(1,6)] + ['Overall']
 IMAGE_DISPLAY_SIZE = (280, 280)
 LOGO_DISPLAY_SIZE = (180, 240)
+SPARK_SIZE = (90, 24)
+HEATMAP_CELL = (52, 24)
+HEATMAP_MAX_COVER = 12
+# Serve the article and store screens from the SQLite mirror in history/ instead of in-memory frames
+SQLITE_BACKEND = False
+# e.g. 'http://127.0.0.1:8765' to show the data of a running data_server.py (over JSON) instead of the files
+DATA_SERVER_URL = None
+# Instances on one machine share one copy of the dataset in shared memory: the first publishes it, the rest
+# attach. Off by default since on Linux/macOS the segments outlive the app (see shared_dataset.py); the
+# snapshot file every instance maps is shared between processes either way.
+SHARED_DATASET = False
+WEEK_BUTTONS_PER_ROW = 14
+SHRINKAGE_ROWS_SHOWN = 500
+SHRINKAGE_VIEWS = {'Line': 'shrinkage_lines', 'Store': 'shrinkage_stores'}
 FONT = ("Segoe UI", 10)
 HEADER_FONT = ("Segoe UI", 10, "bold")
 
@@ -33,67 +45,19 @@ logging.basicConfig(
     level=logging.ERROR
 )
 
-def get_latest_files(directory, pattern, count=5):
-    files = glob.glob(os.path.join(directory, pattern))
-    if 'salesdata' in pattern.lower():
-        def get_num(p):
-            name = os.path.basename(p)
-            num = ''.join(filter(str.isdigit, name))
-            return int(num if num.isdigit() else -1)
-        files = [f for f in files if 'salesdata' in os.path.basename(f).lower()]
-        files.sort(key=get_num)
-    else:
-        files.sort(key=os.path.getmtime)
-    return files[-count:]
-
-def load_sales_data():
-    frames = []
-    for i, path in enumerate(get_latest_files(SALES_DIR, 'salesdata*.xlsx', 5), 1):
-        df = pd.read_excel(path)
-        df.columns = df.columns.str.lower().str.replace(' ', '_')
-        df.rename(columns={'colour':'color','quantity':'qty'}, inplace=True)
-        if all(c in df.columns for c in ['article','store','color','size','qty','asp']):
-            sub = df[['article','store','color','size','qty','asp']].copy()
-            sub['week'] = f'Week {i}'
-            frames.append(sub)
-    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['article','store','color','size','qty','asp','week'])
-
-def load_inventory_data():
-    files = get_latest_files(INVENTORY_DIR, '*.xlsx', 1)
-    if not files:
-        return pd.DataFrame(columns=['article','store','color','size','soh'])
-    df = pd.read_excel(files[0])
-    df.columns = df.columns.str.lower().str.replace(' ', '_')
-    df.rename(columns={'quantity':'soh','colour':'color'}, inplace=True)
-    if all(c in df.columns for c in ['article','store','color','size','soh']):
-        return df[['article','store','color','size','soh']].copy()
-    return pd.DataFrame(columns=['article','store','color','size','soh'])
-
-def load_pending_data():
-    path = os.path.join(PENDING_DIR, 'PENDING ORDERS.xlsx')
-    if not os.path.exists(path):
-        return pd.DataFrame(columns=['article','color','size','pending_qty','mrp'])
-    df = pd.read_excel(path)
-    df.columns = df.columns.str.lower().str.replace(' ', '_')
-    rename_map = {'colour':'color', 'quantity':'pending_qty'}
-    df.rename(columns=rename_map, inplace=True)
-    for col in ['color','size','pending_qty','mrp','article']:
-        if col not in df.columns:
-            df[col] = 0 if col in ['pending_qty','mrp'] else ''
-    return df[['article','color','size','pending_qty','mrp']].copy()
-
-def calculate_asp_map(df):
-    return {art: (g['asp']*g['qty']).sum()/g['qty'].sum() if g['qty'].sum()>0 else 0
-            for art, g in df.groupby('article')}
-
-def merge_data(sales_df, inv_df, asp_map):
-    merged = pd.merge(sales_df, inv_df, on=['article','store','color','size'], how='outer')
-    merged['soh'] = merged['soh'].fillna(0)
-    merged['qty'] = merged['qty'].fillna(0)
-    merged['asp'] = merged['asp'].fillna(0)
-    merged['asp_calc'] = merged['article'].map(asp_map)
-    merged['week'] = merged['week'].fillna('Overall')
-    return merged
+def format_cell(col, v):
+    if col=='Value':
+        return f"₹{v:.2f}"
+    if col=='Sell-Thru':
+        return f"{v:.1f}%"
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    return v
+
+def blend(low, high, t):
+    a = [int(low[i:i+2], 16) for i in (1, 3, 5)]
+    b = [int(high[i:i+2], 16) for i in (1, 3, 5)]
+    return '#' + ''.join(f"{round(x + (y - x) * t):02x}" for x, y in zip(a, b))
 
 class AllInOneApp(tk.Tk):
     def __init__(self):
@@ -102,35 +66,49 @@ class AllInOneApp(tk.Tk):
         self.state('zoomed')
         self.configure(bg="#f0f4f8")
 
-        sales = load_sales_data()
-        inv = load_inventory_data()
-        pending = load_pending_data()
-
-        self.asp_map = calculate_asp_map(sales)
-        self.data = merge_data(sales, inv, self.asp_map)
-        self.inv_data = inv
-        self.pending_data = pending
-
-        self.total_qty = self.data.groupby('article')['qty'].sum().to_dict()
-        self.week_qty = self.data.groupby('week')['qty'].sum().to_dict()
-        self.article_week_qty = self.data.groupby(['article','week'])['qty'].sum().to_dict()
-        self.inv_map = inv.groupby('article')['soh'].sum().to_dict()
-        self.store_inv = inv.groupby(['article','store'])['soh'].sum().to_dict()
-        self.color_inv = inv.groupby(['article','color'])['soh'].sum().to_dict()
-        self.size_inv = inv.groupby(['article','size'])['soh'].sum().to_dict()
-        self.pending_total = pending.groupby('article')['pending_qty'].sum().to_dict()
-        self.pending_color = pending.groupby(['article','color'])['pending_qty'].sum().to_dict()
-        self.pending_size = pending.groupby(['article','size'])['pending_qty'].sum().to_dict()
-        self.pending_colorsize = pending.groupby(['article','color','size'])['pending_qty'].sum().to_dict()
-        self.mrp_map = pending.set_index('article')['mrp'].to_dict()
+        self.client = DataClient(DATA_SERVER_URL) if DATA_SERVER_URL else None
+        self.engine = None
+        if self.client is not None:
+            try:
+                self.engine = self.client.engine()
+            except (OSError, ValueError) as e:
+                logging.error(f"Data server unavailable, loading the files directly: {e}")
+                self.client = None
+        if self.engine is None:
+            # Attached to the dataset another instance published, or mapped from the prebuilt snapshot
+            # when no input changed since it was written
+            db = SalesDatabase() if SQLITE_BACKEND else None
+            self.engine = attach_or_publish(db=db) if SHARED_DATASET else load_or_build(db=db)
+        self.heatmap_on = False
+        self.heatmap_metric = 'Sell-Thru'
+        self.heatmap_cells = []
+        self.heatmap_labels = []
 
         self.overview = True
-        self.articles = sorted(self.total_qty, key=self.total_qty.get, reverse=True)
+        self.articles = self.engine.rankings()
         self.idx = 0
         self.week = 'Overall'
+        self.store_mode = False
+        self.stores = self.engine.rankings(by='store')
+        self.store_idx = 0
+        self.table_rows = {}
+        self.table_sort = {}
+        self.compare_articles = []
+        self.compare_window = None
+        self.chart_window = None
+        self.shrinkage_window = None
+        self.jobs = JobQueue()
+        self.watcher = ServerWatcher(self.client) if self.client is not None else DataWatcher()
+        self.reload_pool = ThreadPoolExecutor(max_workers=1)
+        self.reload_future = None
+        self.reload_changes = set()
+        self.window = self.engine.window
+        self.inv_target = None
 
         self._build_ui()
         self._show()
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+        self.after(WATCH_POLL_MS, self._poll_reload)
 
     def _build_ui(self):
         style = ttk.Style(self)
@@ -162,32 +140,63 @@ class AllInOneApp(tk.Tk):
         ttk.Button(nav_frame, text='Next', style='PrevNext.TButton', command=self._next).pack(side='left', padx=(2, 8))
         ttk.Button(nav_frame, text='First', style='FirstLast.TButton', command=self._first).pack(side='left', padx=0)
         ttk.Button(nav_frame, text='Last', style='FirstLast.TButton', command=self._last).pack(side='left', padx=2)
+        self.mode_button = ttk.Button(nav_frame, text='Store View', style='Accent.TButton', command=self._toggle_store_mode)
+        self.mode_button.pack(side='left', padx=(8, 0))
+        ttk.Button(nav_frame, text='Compare +', style='Accent.TButton', command=self._add_to_compare).pack(side='left', padx=(2, 0))
+        ttk.Button(nav_frame, text='Charts', style='Accent.TButton', command=self._open_chart).pack(side='left', padx=(2, 0))
+        ttk.Button(nav_frame, text='Shrinkage', style='Accent.TButton', command=self._show_shrinkage).pack(side='left', padx=(2, 0))
+        ttk.Button(nav_frame, text='Export Article', style='Accent.TButton', command=self._export_article).pack(side='left', padx=(8, 0))
+        ttk.Button(nav_frame, text='Export All', style='Accent.TButton', command=self._export_all).pack(side='left', padx=(2, 0))
         self.store_count_label = tk.Label(top, text="", font=FONT, fg="#1976d2", bg='#e3f2fd')
         self.store_count_label.pack(side='left', padx=10)
         self.zero_sales_stores_label = tk.Label(top, text="", font=FONT, fg="#FF0000", bg='#e3f2fd')
         self.zero_sales_stores_label.pack(side='left', padx=10)
+        JobPanel(top, self.jobs, font=FONT).pack(side='left', padx=10)
 
         sf = tk.Frame(self, bg='#bbdefb', bd=1, relief='groove')
         sf.pack(fill='x', pady=(0,10))
-        headers = ['Article No','Rank','ASP',f'MRP','Sales','Revenue','Inventory','Pending']
+        headers = ['Article No','Rank','ASP',f'MRP','Sales','Trend','Revenue','Inventory','Pending']
         self.summary = {}
         for i,h in enumerate(headers):
             tk.Label(sf, text=h, font=HEADER_FONT, bg='#bbdefb', fg='#212121').grid(row=0,column=i,padx=5,pady=2)
-            lbl = tk.Label(sf, text='', font=FONT, bg='#e3f2fd', fg='#212121', width=12)
-            lbl.grid(row=1,column=i,padx=5,pady=2)
+            if h=='Trend':
+                trend_frame = tk.Frame(sf, bg='#e3f2fd')
+                trend_frame.grid(row=1,column=i,padx=5,pady=2)
+                self.spark_canvas = tk.Canvas(trend_frame, width=SPARK_SIZE[0], height=SPARK_SIZE[1], bg='#e3f2fd', highlightthickness=0)
+                self.spark_canvas.pack(side='left')
+                # One line and one end dot, moved to each series shown instead of drawn anew
+                self.spark_line = self.spark_canvas.create_line(0, 0, 0, 0, fill='#1976d2', width=1.5, state='hidden')
+                self.spark_dot = self.spark_canvas.create_oval(0, 0, 0, 0, state='hidden')
+                lbl = tk.Label(trend_frame, text='', font=FONT, bg='#e3f2fd', fg='#212121', width=8)
+                lbl.pack(side='left')
+            else:
+                lbl = tk.Label(sf, text='', font=FONT, bg='#e3f2fd', fg='#212121', width=12)
+                lbl.grid(row=1,column=i,padx=5,pady=2)
             self.summary[h] = lbl
 
         wf = tk.Frame(self, bg='#e3f2fd')
         wf.pack(fill='x', pady=(0,10))
+        window_frame = tk.Frame(wf, bg='#e3f2fd')
+        window_frame.pack(side='right', padx=5)
+        tk.Label(window_frame, text='SOH as of', font=FONT, bg='#e3f2fd', fg='#212121').pack(side='left')
+        self.inv_var = tk.StringVar()
+        self.inv_box = ttk.Combobox(window_frame, textvariable=self.inv_var, state='readonly', width=14, font=FONT)
+        self.inv_box.pack(side='left', padx=(4, 12))
+        self.inv_box.bind('<<ComboboxSelected>>', lambda e: self._set_inventory(self.inv_box.current()))
+        self._update_inventory_choices()
+        tk.Label(window_frame, text='Window (weeks)', font=FONT, bg='#e3f2fd', fg='#212121').pack(side='left')
+        self.window_var = tk.StringVar(value=str(self.window))
+        window_box = ttk.Combobox(window_frame, textvariable=self.window_var, values=WINDOW_CHOICES, state='readonly', width=4, font=FONT)
+        window_box.pack(side='left', padx=(4, 0))
+        window_box.bind('<<ComboboxSelected>>', lambda e: self._set_window(int(self.window_var.get())))
+        self.week_frame = tk.Frame(wf, bg='#e3f2fd')
+        self.week_frame.pack(side='left', fill='x')
         self.week_buttons = {}
-        for w in WEEKS:
-            cnt = self.week_qty.get(w, sum(self.week_qty.values())) if w!='Overall' else sum(self.week_qty.values())
-            btn = ttk.Button(wf, text=f"{w} ({cnt})", style='Accent.TButton', command=lambda x=w: self._set_week(x))
-            btn.pack(side='left', padx=5)
-            self.week_buttons[w] = btn
+        self._build_week_buttons()
 
         cf = tk.Frame(self, bg='#e3f2fd')
         cf.pack(fill='both', expand=True, padx=10, pady=5)
+        self.article_frame = cf
         left = tk.Frame(cf, bg='#e3f2fd')
         left.pack(side='left', fill='y', padx=(0,10))
         ip = tk.LabelFrame(left, text='Image Preview', bg='#e3f2fd', font=HEADER_FONT, bd=2, relief='solid', fg='#1976d2')
@@ -220,18 +229,44 @@ class AllInOneApp(tk.Tk):
         self.size_tree = self._make_table(size_frame, 'Size', height=6)
         detail_frame = ttk.LabelFrame(tables_frame, text='Color-Size-wise', style="Bold.TLabelframe")
         detail_frame.pack(fill='both', expand=True, pady=(0,5))
+        heat_bar = tk.Frame(detail_frame, bg='#e3f2fd')
+        heat_bar.pack(fill='x')
+        self.heatmap_button = ttk.Button(heat_bar, text='Heatmap', style='Accent.TButton', command=self._toggle_heatmap)
+        self.heatmap_button.pack(side='left', padx=2, pady=2)
+        self.heatmap_metric_button = ttk.Button(heat_bar, text=f"Shade: {self.heatmap_metric}", style='Accent.TButton', command=self._toggle_heatmap_metric)
+        self.heatmap_metric_button.pack(side='left', padx=2, pady=2)
         self.detail_tree = self._make_detail_table(detail_frame, height=12)
+        self.heatmap_canvas = tk.Canvas(detail_frame, bg='#e3f2fd', highlightthickness=0)
+
+        self.store_view_frame = ttk.LabelFrame(self, text='Articles at Store', style="Bold.TLabelframe")
+        self.store_article_tree = self._make_store_article_table(self.store_view_frame, height=24)
+        self.store_article_tree.bind("<Double-1>", self._on_store_article_double_click)
 
         footer = tk.Frame(self, bg='#e3f2fd')
         footer.pack(side='bottom', fill='x')
         tk.Label(footer, text="For Lazera - made by kunal", font=("Segoe UI", 7), fg="#1976d2", bg='#e3f2fd', anchor='se').pack(side='right', padx=6, pady=2)
+        self.data_label = tk.Label(footer, text="", font=("Segoe UI", 7), fg="#1976d2", bg='#e3f2fd', anchor='sw')
+        self.data_label.pack(side='left', padx=6, pady=2)
+        self._update_data_label()
+
+    def _build_week_buttons(self):
+        # One button per week in the current window, wrapped onto extra rows for long windows
+        for btn in self.week_buttons.values():
+            btn.destroy()
+        self.week_buttons = {}
+        total = sum(self.engine.week_qty.values())
+        for i, w in enumerate(self.engine.weeks + ['Overall']):
+            cnt = self.engine.week_qty.get(w, 0) if w!='Overall' else total
+            btn = ttk.Button(self.week_frame, text=f"{w} ({int(cnt)})", style='Accent.TButton', command=lambda x=w: self._set_week(x))
+            btn.grid(row=i // WEEK_BUTTONS_PER_ROW, column=i % WEEK_BUTTONS_PER_ROW, padx=5, pady=1, sticky='ew')
+            self.week_buttons[w] = btn
 
     def _make_table(self, parent, key, height=8):
-        cols = (key,'Qty','Pending','SOH','Value') if key!='Store' else (key,'Qty','SOH','Value')
+        cols = (key,'Qty','Pending','SOH','Value') if key!='Store' else (key,'Qty','SOH','Value','Trend')
         tv = ttk.Treeview(parent, columns=cols, show='headings', height=height, style='Treeview')
         for c in cols:
-            tv.heading(c, text=c, anchor='center')
-            width = 200 if c==key else 80
+            tv.heading(c, text=c, anchor='center', command=lambda col=c: self._sort_table(tv, col))
+            width = 200 if c==key else 60 if c=='Trend' else 80
             tv.column(c, width=width, anchor='center')
         tv.pack(fill='both', expand=True)
         setattr(self, f'{key.lower()}_tree', tv)
@@ -241,65 +276,86 @@ class AllInOneApp(tk.Tk):
         cols = ('Color','Size','Qty','Pending','SOH')
         tv = ttk.Treeview(parent, columns=cols, show='headings', height=height, style='Treeview')
         for c in cols:
-            tv.heading(c, text=c, anchor='center')
+            tv.heading(c, text=c, anchor='center', command=lambda col=c: self._sort_table(tv, col))
             width = 120 if c in ('Color','Size') else 80
             tv.column(c, width=width, anchor='center')
         tv.pack(fill='both', expand=True)
         return tv
 
+    def _make_store_article_table(self, parent, height=24):
+        tv = ttk.Treeview(parent, show='headings', height=height, style='Treeview')
+        self._set_store_article_columns(tv)
+        tv.tag_configure('zero', foreground='#FF0000')
+        scroll = ttk.Scrollbar(parent, orient='vertical', command=tv.yview)
+        tv.configure(yscrollcommand=scroll.set)
+        scroll.pack(side='right', fill='y')
+        tv.pack(fill='both', expand=True)
+        return tv
+
+    def _set_store_article_columns(self, tv):
+        cols = ('Article',) + tuple(self.engine.weeks) + ('Total','SOH','Sell-Thru')
+        tv.configure(columns=cols)
+        width = 90 if len(cols) <= 12 else 60
+        for c in cols:
+            tv.heading(c, text=c, anchor='center', command=lambda col=c: self._sort_table(tv, col))
+            tv.column(c, width=160 if c=='Article' else width, anchor='center')
+        self.table_sort.pop(str(tv), None)
+
     def _show(self):
-        if self.overview:
-            if self.week == 'Overall':
-                total_sales = self.data['qty'].sum()
-            else:
-                total_sales = self.data[self.data['week'] == self.week]['qty'].sum()
-            total_inv = self.data['soh'].sum()
-            total_pending = sum(self.pending_total.values())
-            self.summary['Article No'].config(text='Overview')
-            self.summary['Rank'].config(text='')
-            self.summary['ASP'].config(text='')
-            self.summary['MRP'].config(text='')
-            self.summary['Sales'].config(text=int(total_sales))
-            self.summary['Revenue'].config(text='')
-            self.summary['Inventory'].config(text=int(total_inv))
-            self.summary['Pending'].config(text=int(total_pending))
-            self.store_count_label.config(text="")
-            self.zero_sales_stores_label.config(text="")
+        if self.store_mode:
+            self._show_store()
+        elif self.overview:
+            self._show_overview()
+        else:
+            self._show_article()
+        self._update_chart()
+        if self.heatmap_on and not self.store_mode:
+            self._draw_heatmap()
+
+    def _show_overview(self):
+        view = self.engine.overview[self.week]
+        self.summary['Article No'].config(text='Overview')
+        self.summary['Rank'].config(text='')
+        self.summary['ASP'].config(text='')
+        self.summary['MRP'].config(text='')
+        self.summary['Sales'].config(text=int(view['sales']))
+        self.summary['Revenue'].config(text=f"₹{view['revenue']:.2f}")
+        self.summary['Inventory'].config(text=int(view['inventory']))
+        self.summary['Pending'].config(text=int(view['pending']))
+        self.store_count_label.config(text=f"Stores Available: {len(self.engine.store_soh)}")
+        self.zero_sales_stores_label.config(text="")
+        for w,btn in self.week_buttons.items():
+            btn.config(text=f"{w} ({int(self.engine.overview[w]['sales'])})")
+        series = [self.engine.overview[w]['sales'] for w in self.engine.weeks]
+        self._show_trend(series, self._pct_change(series))
+        if not hasattr(self, 'logo_preview') and os.path.exists(LOGO_PATH):
             img = Image.open(LOGO_PATH)
             img.thumbnail(IMAGE_DISPLAY_SIZE)
-            self.photo = ImageTk.PhotoImage(img)
-            self.image_label.config(image=self.photo, text='')
-            for tbl in ('store','color','size','detail'):
-                getattr(self, f'{tbl}_tree').delete(*getattr(self, f'{tbl}_tree').get_children())
-            return
+            self.logo_preview = ImageTk.PhotoImage(img)
+        self.image_label.config(image=getattr(self, 'logo_preview', ''), text='')
+        for tbl in ('store','color','size','detail'):
+            self._fill_table(getattr(self, f'{tbl}_tree'), view[tbl])
 
+    def _show_article(self):
         art = self.articles[self.idx]
         if self.week=='Overall':
-            sold = self.total_qty.get(art,0)
-            dfw = self.data[self.data['article']==art]
+            sold = self.engine.total_qty.get(art,0)
         else:
-            sold = self.article_week_qty.get((art,self.week),0)
-            dfw = self.data[(self.data['article']==art)&(self.data['week']==self.week)]
-        asp = self.asp_map.get(art,0)
-        mrp = self.mrp_map.get(art, MRP_FIXED)
+            sold = self.engine.article_week_qty.get((art,self.week),0)
+        asp = self.engine.asp_map.get(art,0)
+        mrp = self.engine.mrp_map.get(art, MRP_FIXED)
         revenue = round(sold*asp,2)
-        inv_tot = self.inv_map.get(art,0)
-        pending_tot = self.pending_total.get(art,0)
+        inv_tot = self.engine.inv_map.get(art,0)
+        pending_tot = self.engine.pending_total.get(art,0)
         total = len(self.articles)
 
-        # Store counts
-        stores_with_stock = set(self.inv_data[(self.inv_data['article']==art) & (self.inv_data['soh']>0)]['store'].unique())
-        store_count = len(stores_with_stock)
-        self.store_count_label.config(text=f"Stores Available: {store_count}")
-
-        # Stores with SOH > 0 and 0 sales in last 5 weeks
-        sales_df = self.data[self.data['article'] == art]
-        stores_with_sales = set(sales_df[sales_df['qty'] > 0]['store'].unique())
-        zero_sales_stores = stores_with_stock - stores_with_sales
-        self.zero_sales_stores_label.config(text=f"Stores with 0 Sales: {len(zero_sales_stores)}")
+        # Store counts; zero sales = stores with SOH > 0 and 0 sales in last 5 weeks
+        summary = self.engine.article_summary.get(art, {})
+        self.store_count_label.config(text=f"Stores Available: {summary.get('stores_stocked', 0)}")
+        self.zero_sales_stores_label.config(text=f"Stores with 0 Sales: {summary.get('zero_sale_stores', 0)}")
 
         for w,btn in self.week_buttons.items():
-            cnt = self.total_qty.get(art,0) if w=='Overall' else self.article_week_qty.get((art,w),0)
+            cnt = self.engine.total_qty.get(art,0) if w=='Overall' else self.engine.article_week_qty.get((art,w),0)
             btn.config(text=f"{w} ({cnt})")
         s = self.summary
         s['Article No'].config(text=art)
@@ -310,8 +366,14 @@ class AllInOneApp(tk.Tk):
         s['Revenue'].config(text=f"₹{revenue:.2f}")
         s['Inventory'].config(text=inv_tot)
         s['Pending'].config(text=pending_tot)
+        week_row, week_matrix, week_change = self.engine.week_matrix
+        row = week_row.get(art)
+        if row is None:
+            self._show_trend([0]*len(self.engine.weeks), np.nan)
+        else:
+            self._show_trend(week_matrix[row], week_change[row])
 
-        path = next((os.path.join(IMAGE_DIR,f'{art}{ext}') for ext in ['.jpg','.jpeg','.png'] if os.path.exists(os.path.join(IMAGE_DIR,f'{art}{ext}'))),None)
+        path = find_image_path(art)
         if path:
             img = Image.open(path)
             img.thumbnail(IMAGE_DISPLAY_SIZE)
@@ -320,63 +382,355 @@ class AllInOneApp(tk.Tk):
         else:
             self.image_label.config(image='', text='No Image', fg='#1976d2')
 
-        # Store Table
-        self.store_tree.delete(*self.store_tree.get_children())
-        qty_map = dfw.groupby('store')['qty'].sum().to_dict()
-        items = [i for (a,i) in self.store_inv.keys() if a==art]
-        items.sort(key=lambda x: qty_map.get(x,0), reverse=True)
-        for val in items:
-            qty = qty_map.get(val,0)
-            soh = self.store_inv.get((art,val),0)
-            valp = round(qty*asp,2)
-            self.store_tree.insert('', 'end', values=(val, qty, soh, f"₹{valp:.2f}"))
-
-        # Color Table
-        self.color_tree.delete(*self.color_tree.get_children())
-        qty_map = dfw.groupby('color')['qty'].sum().to_dict()
-        items = [i for (a,i) in self.color_inv.keys() if a==art]
-        items.sort(key=lambda x: qty_map.get(x,0), reverse=True)
-        for val in items:
-            qty = qty_map.get(val,0)
-            soh = self.color_inv.get((art,val),0)
-            pend = self.pending_color.get((art,val),0)
-            valp = round(qty*asp,2)
-            self.color_tree.insert('', 'end', values=(val, qty, pend, soh, f"₹{valp:.2f}"))
-
-        # Size Table
-        self.size_tree.delete(*self.size_tree.get_children())
-        qty_map = dfw.groupby('size')['qty'].sum().to_dict()
-        items = [i for (a,i) in self.size_inv.keys() if a==art]
-        items.sort(key=lambda x: qty_map.get(x,0), reverse=True)
-        for val in items:
-            qty = qty_map.get(val,0)
-            soh = self.size_inv.get((art,val),0)
-            pend = self.pending_size.get((art,val),0)
-            valp = round(qty*asp,2)
-            self.size_tree.insert('', 'end', values=(val, qty, pend, soh, f"₹{valp:.2f}"))
-
-        # Color-Size Table
-        self.detail_tree.delete(*self.detail_tree.get_children())
-        detail = dfw.groupby(['color','size']).agg({'qty':'sum','soh':'sum'}).reset_index()
-        for _, row in detail.iterrows():
-            color, size = row['color'], row['size']
-            qty = row['qty']
-            soh = row['soh']
-            pend = self.pending_colorsize.get((art, color, size), 0)
-            self.detail_tree.insert('', 'end', values=(color, size, qty, pend, soh))
+        tables = self.engine.article_breakdown(art, self.week)
+        for tbl in ('store','color','size','detail'):
+            self._fill_table(getattr(self, f'{tbl}_tree'), tables[tbl])
+
+    def _toggle_heatmap(self):
+        self.heatmap_on = not self.heatmap_on
+        if self.heatmap_on:
+            self.detail_tree.pack_forget()
+            self.heatmap_canvas.pack(fill='both', expand=True)
+            self.heatmap_button.config(text='Table')
+            self._draw_heatmap()
+        else:
+            self.heatmap_canvas.pack_forget()
+            self.detail_tree.pack(fill='both', expand=True)
+            self.heatmap_button.config(text='Heatmap')
+
+    def _toggle_heatmap_metric(self):
+        self.heatmap_metric = 'Cover' if self.heatmap_metric=='Sell-Thru' else 'Sell-Thru'
+        self.heatmap_metric_button.config(text=f"Shade: {self.heatmap_metric}")
+        if self.heatmap_on:
+            self._draw_heatmap()
+
+    def _heatmap_item(self, pool, i, cell):
+        canvas = self.heatmap_canvas
+        while len(pool) <= i:
+            if cell:
+                pool.append((canvas.create_rectangle(0, 0, 0, 0, outline='#ffffff'), canvas.create_text(0, 0, font=FONT)))
+            else:
+                pool.append(canvas.create_text(0, 0, font=HEADER_FONT, fill='#1976d2'))
+        return pool[i]
+
+    def _draw_heatmap(self):
+        key = None if self.overview else self.articles[self.idx]
+        colors, sizes, cube = self.engine.colorsize(key, self.week)
+        qty, soh = cube[0], cube[1]
+        if self.heatmap_metric=='Sell-Thru':
+            moved = qty + soh
+            score = np.divide(qty, moved, out=np.zeros_like(qty), where=moved > 0)
+        else:
+            # Weekly rate over the weeks the cells cover: the whole window, or just the selected week
+            rate = qty / (len(self.engine.weeks) if self.week=='Overall' else 1)
+            cover = np.divide(soh, rate, out=np.full_like(soh, HEATMAP_MAX_COVER), where=rate > 0)
+            score = 1 - np.minimum(cover, HEATMAP_MAX_COVER) / HEATMAP_MAX_COVER
+        canvas = self.heatmap_canvas
+        cw, ch = HEATMAP_CELL
+        left = 100
+        labels = [('Qty/SOH', left/2, ch/2)] + [(sz, left + (j+0.5)*cw, ch/2) for j, sz in enumerate(sizes)] + [(c, left/2, (i+1.5)*ch) for i, c in enumerate(colors)]
+        for n, (text, x, y) in enumerate(labels):
+            item = self._heatmap_item(self.heatmap_labels, n, False)
+            canvas.coords(item, x, y)
+            canvas.itemconfigure(item, text=text, state='normal')
+        for item in self.heatmap_labels[len(labels):]:
+            canvas.itemconfigure(item, state='hidden')
+        n = 0
+        for i in range(len(colors)):
+            for j in range(len(sizes)):
+                rect, text = self._heatmap_item(self.heatmap_cells, n, True)
+                x0, y0 = left + j*cw, (i+1)*ch
+                empty = qty[i, j]==0 and soh[i, j]==0
+                canvas.coords(rect, x0, y0, x0+cw, y0+ch)
+                canvas.itemconfigure(rect, fill='#eeeeee' if empty else blend('#ffcdd2', '#66bb6a', score[i, j]), state='normal')
+                canvas.coords(text, x0+cw/2, y0+ch/2)
+                canvas.itemconfigure(text, text='' if empty else f"{int(qty[i, j])}/{int(soh[i, j])}", state='normal')
+                n += 1
+        for rect, text in self.heatmap_cells[n:]:
+            canvas.itemconfigure(rect, state='hidden')
+            canvas.itemconfigure(text, state='hidden')
+
+    def _pct_change(self, series):
+        return (series[-1] - series[-2]) / series[-2] * 100 if len(series) > 1 and series[-2] else np.nan
+
+    def _show_trend(self, series, change):
+        canvas = self.spark_canvas
+        if not len(series):
+            canvas.itemconfigure(self.spark_line, state='hidden')
+            canvas.itemconfigure(self.spark_dot, state='hidden')
+            self.summary['Trend'].config(text='—', fg='#212121')
+            return
+        w, h = SPARK_SIZE
+        lo, hi = min(series), max(series)
+        span = (hi - lo) or 1
+        step = (w - 6) / max(len(series) - 1, 1)
+        points = [(3 + i*step, h - 3 - (v - lo) / span * (h - 6)) for i, v in enumerate(series)]
+        # A line needs two points; a single week is drawn as a dot
+        points = points * (2 if len(points) == 1 else 1)
+        color = '#2e7d32' if len(series) < 2 or series[-1] >= series[-2] else '#d32f2f'
+        canvas.coords(self.spark_line, *[c for p in points for c in p])
+        canvas.itemconfigure(self.spark_line, state='normal')
+        x, y = points[-1]
+        canvas.coords(self.spark_dot, x-2, y-2, x+2, y+2)
+        canvas.itemconfigure(self.spark_dot, fill=color, outline=color, state='normal')
+        if np.isnan(change):
+            self.summary['Trend'].config(text='—', fg='#212121')
+        else:
+            self.summary['Trend'].config(text=f"{change:+.0f}%", fg='#2e7d32' if change >= 0 else '#d32f2f')
+
+    def _fill_table(self, tree, rows, tags=None):
+        key = str(tree)
+        self.table_rows[key] = (rows, {})
+        order = self._sort_order(tree, *self.table_sort[key]) if key in self.table_sort else range(len(rows))
+        tree.delete(*tree.get_children())
+        cols = tree['columns']
+        for i in order:
+            tree.insert('', 'end', iid=str(i), values=[format_cell(c,v) for c,v in zip(cols,rows[i])], tags=tags[i] if tags else ())
+
+    def _sort_order(self, tree, col, desc):
+        rows, cache = self.table_rows[str(tree)]
+        if col not in cache:
+            try:
+                cache[col] = np.argsort(np.array([r[col] for r in rows]), kind='stable')
+            except TypeError:
+                cache[col] = np.array(sorted(range(len(rows)), key=lambda i: str(rows[i][col])), dtype=int)
+        return cache[col][::-1] if desc else cache[col]
+
+    def _sort_table(self, tree, col):
+        key = str(tree)
+        cols = tree['columns']
+        idx = cols.index(col)
+        desc = self.table_sort.get(key) == (idx, False)
+        self.table_sort[key] = (idx, desc)
+        if key in self.table_rows:
+            for pos, i in enumerate(self._sort_order(tree, idx, desc)):
+                tree.move(str(i), '', pos)
+        for c in cols:
+            tree.heading(c, text=c + ((' ▼' if desc else ' ▲') if c==col else ''))
+
+    def _show_store(self):
+        if not self.stores:
+            self.summary['Article No'].config(text='No Stores')
+            return
+        store = self.stores[self.store_idx]
+        rows = self.engine.store_index.get(store, [])
+        if self.week=='Overall':
+            sold = self.engine.store_qty.get(store,0)
+            revenue = self.engine.store_value.get(store,0)
+        else:
+            sold = self.engine.store_week_qty.get((store,self.week),0)
+            revenue = self.engine.store_week_value.get((store,self.week),0)
+        zero_lines = [r for r in rows if r[-3]==0 and r[-2]>0]
+
+        for w,btn in self.week_buttons.items():
+            cnt = self.engine.store_qty.get(store,0) if w=='Overall' else self.engine.store_week_qty.get((store,w),0)
+            btn.config(text=f"{w} ({int(cnt)})")
+        s = self.summary
+        s['Article No'].config(text=store)
+        s['Rank'].config(text=f"{self.store_idx+1}/{len(self.stores)}")
+        s['ASP'].config(text=f"₹{revenue/sold:.2f}" if sold else '')
+        s['MRP'].config(text='')
+        s['Sales'].config(text=int(sold))
+        s['Revenue'].config(text=f"₹{revenue:.2f}")
+        s['Inventory'].config(text=int(self.engine.store_soh.get(store,0)))
+        s['Pending'].config(text='')
+        series = [self.engine.store_week_qty.get((store,w),0) for w in self.engine.weeks]
+        self._show_trend(series, self._pct_change(series))
+        self.store_count_label.config(text=f"Articles: {len(rows)}")
+        self.zero_sales_stores_label.config(text=f"Articles with 0 Sales: {len(zero_lines)}")
+        self.image_label.config(image='', text='')
+
+        self._fill_table(self.store_article_tree, rows, tags=[('zero',) if r[-3]==0 and r[-2]>0 else () for r in rows])
+
+    def _on_store_article_double_click(self, event):
+        item = self.store_article_tree.selection()
+        if not item:
+            return
+        art = self.store_article_tree.item(item, "values")[0]
+        if art not in self.articles:
+            return
+        self.idx = self.articles.index(art)
+        self.overview = False
+        self._toggle_store_mode()
+
+    def _toggle_store_mode(self):
+        self.store_mode = not self.store_mode
+        if self.store_mode:
+            self.article_frame.pack_forget()
+            self.store_view_frame.pack(fill='both', expand=True, padx=10, pady=5)
+            self.mode_button.config(text='Article View')
+        else:
+            self.store_view_frame.pack_forget()
+            self.article_frame.pack(fill='both', expand=True, padx=10, pady=5)
+            self.mode_button.config(text='Store View')
+        self._show()
+
+    def _add_to_compare(self):
+        if self.store_mode or self.overview:
+            return
+        art = self.articles[self.idx]
+        if art not in self.compare_articles:
+            self.compare_articles.append(art)
+        self._show_compare()
+
+    def _clear_compare(self):
+        self.compare_articles = []
+        self._show_compare()
+
+    def _show_compare(self):
+        if self.compare_window is None or not self.compare_window.winfo_exists():
+            self.compare_window = tk.Toplevel(self)
+            self.compare_window.title("Compare Articles")
+            self.compare_window.geometry(f"{min(900, self.winfo_screenwidth()//2)}x{min(600, self.winfo_screenheight()//2)}")
+            self.compare_tree = ttk.Treeview(self.compare_window, show='headings', height=20, style='Treeview')
+            self.compare_tree.pack(fill='both', expand=True, padx=10, pady=10)
+            btns = tk.Frame(self.compare_window)
+            btns.pack(pady=6)
+            ttk.Button(btns, text="Clear", style='Accent.TButton', command=self._clear_compare).pack(side='left', padx=4)
+            ttk.Button(btns, text="Close", style='Accent.TButton', command=self.compare_window.destroy).pack(side='left', padx=4)
+        arts = self.compare_articles
+        summaries = [self.engine.article_summary.get(a, {}) for a in arts]
+        cols = ('Metric',) + tuple(str(a) for a in arts)
+        tree = self.compare_tree
+        tree.delete(*tree.get_children())
+        tree.configure(columns=cols)
+        for c in cols:
+            tree.heading(c, text=c, anchor='center')
+            tree.column(c, width=140 if c=='Metric' else 100, anchor='center')
+        rows = [(w, [sm.get('weeks', [0]*len(self.engine.weeks))[i] for sm in summaries]) for i,w in enumerate(self.engine.weeks)]
+        rows += [
+            ('Total', [self.engine.total_qty.get(a,0) for a in arts]),
+            ('ASP', [f"₹{self.engine.asp_map.get(a,0):.2f}" for a in arts]),
+            ('MRP', [f"₹{self.engine.mrp_map.get(a, MRP_FIXED)}" for a in arts]),
+            ('SOH', [sm.get('soh',0) for sm in summaries]),
+            ('Pending', [sm.get('pending',0) for sm in summaries]),
+            ('Stores Available', [sm.get('stores_stocked',0) for sm in summaries]),
+            ('Stores Selling', [sm.get('stores_selling',0) for sm in summaries]),
+            ('Stores with 0 Sales', [sm.get('zero_sale_stores',0) for sm in summaries]),
+        ]
+        sizes = sorted({sz for sm in summaries for sz in sm.get('sizes', {})}, key=lambda x: (isinstance(x, str), x))
+        for sz in sizes:
+            rows.append((f"Size {sz} %", [f"{100*sm['sizes'].get(sz,0)/max(sum(sm['sizes'].values()),1):.1f}%" for sm in summaries]))
+        for metric, vals in rows:
+            tree.insert('', 'end', values=(metric, *(format_cell(metric, v) for v in vals)))
+        self.compare_window.lift()
+
+    def _show_shrinkage(self):
+        # Ranked negative inferred receipts (SOH_t - SOH_t-1 + sales_t < 0), per SKU-store line or per store
+        if self.shrinkage_window is None or not self.shrinkage_window.winfo_exists():
+            self.shrinkage_window = tk.Toplevel(self)
+            self.shrinkage_window.title("Shrinkage Exceptions")
+            self.shrinkage_window.geometry(f"{min(1000, self.winfo_screenwidth()//2)}x{min(600, self.winfo_screenheight()//2)}")
+            bar = tk.Frame(self.shrinkage_window)
+            bar.pack(fill='x', padx=10, pady=(10, 0))
+            tk.Label(bar, text='Rank by', font=FONT).pack(side='left')
+            self.shrinkage_view = tk.StringVar(value='Line')
+            view_box = ttk.Combobox(bar, textvariable=self.shrinkage_view, values=list(SHRINKAGE_VIEWS), state='readonly', width=8, font=FONT)
+            view_box.pack(side='left', padx=4)
+            view_box.bind('<<ComboboxSelected>>', lambda e: self._show_shrinkage())
+            self.shrinkage_label = tk.Label(bar, text='', font=FONT)
+            self.shrinkage_label.pack(side='left', padx=8)
+            self.shrinkage_tree = ttk.Treeview(self.shrinkage_window, show='headings', height=20, style='Treeview')
+            self.shrinkage_tree.pack(fill='both', expand=True, padx=10, pady=10)
+            btns = tk.Frame(self.shrinkage_window)
+            btns.pack(pady=6)
+            ttk.Button(btns, text="Export", style='Accent.TButton', command=self._export_shrinkage).pack(side='left', padx=4)
+            ttk.Button(btns, text="Close", style='Accent.TButton', command=self.shrinkage_window.destroy).pack(side='left', padx=4)
+        frame = REPORTS[SHRINKAGE_VIEWS[self.shrinkage_view.get()]](self.engine)
+        tree = self.shrinkage_tree
+        tree.delete(*tree.get_children())
+        cols = [str(c) for c in frame.columns]
+        tree.configure(columns=cols)
+        for c in cols:
+            tree.heading(c, text=c.replace('_', ' ').title(), anchor='center')
+            tree.column(c, width=200 if c == 'store' else 90, anchor='center')
+        for row in frame.head(SHRINKAGE_ROWS_SHOWN).itertuples(index=False, name=None):
+            tree.insert('', 'end', values=[format_cell(c, v) for c, v in zip(cols, row)])
+        self.shrinkage_label.config(text=f"{len(frame)} exceptions, {-frame['receipts'].sum():.0f} units unaccounted"
+                                         + (f" (top {SHRINKAGE_ROWS_SHOWN} shown)" if len(frame) > SHRINKAGE_ROWS_SHOWN else ''))
+        self.shrinkage_window.lift()
+
+    def _export_shrinkage(self):
+        engine = self.engine
+        file_path = filedialog.asksaveasfilename(defaultextension=".xlsx", filetypes=[("Excel files", "*.xlsx")],
+                                                 initialfile="shrinkage.xlsx", parent=self.shrinkage_window)
+        if not file_path:
+            return
+        self.jobs.submit("Export shrinkage", lambda path, progress: write_xlsx({name: REPORTS[name](engine) for name in RECONCILIATION_REPORTS}, path), file_path)
+
+    def _chart_values(self):
+        weeks = self.engine.weeks
+        if self.store_mode:
+            store = self.stores[self.store_idx] if self.stores else ''
+            return store, [self.engine.store_week_qty.get((store,w),0) for w in weeks], self.engine.store_soh.get(store,0), {}
+        if self.overview:
+            return 'Overview', [self.engine.overview[w]['sales'] for w in weeks], self.engine.overview['Overall']['inventory'], {r[0]: r[1] for r in self.engine.overview['Overall']['size']}
+        art = self.articles[self.idx]
+        week_row, week_matrix, _ = self.engine.week_matrix
+        row = week_row.get(art)
+        series = list(week_matrix[row]) if row is not None else [0]*len(weeks)
+        summary = self.engine.article_summary.get(art, {})
+        return art, series, summary.get('soh',0), summary.get('sizes',{})
+
+    def _open_chart(self):
+        if self.chart_window is None or not self.chart_window.winfo_exists():
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+            self.chart_window = tk.Toplevel(self)
+            self.chart_window.title("Charts")
+            fig = Figure(figsize=(7, 6), dpi=100)
+            ax_week, ax_size = fig.subplots(2, 1)
+            ax_soh = ax_week.twinx()
+            self.chart_sales, = ax_week.plot([], [], marker='o', color='#1976d2', label='Sales')
+            self.chart_soh, = ax_soh.plot([], [], linestyle='--', color='#f44336', label='SOH')
+            ax_week.set_ylabel('Sales')
+            ax_soh.set_ylabel('SOH')
+            ax_week.legend(handles=[self.chart_sales, self.chart_soh], loc='upper left')
+            self.chart_sizes = sorted({r[0] for r in self.engine.overview['Overall']['size']}, key=lambda x: (isinstance(x, str), x))
+            self.chart_bars = ax_size.bar([str(sz) for sz in self.chart_sizes], [0]*len(self.chart_sizes), color='#1976d2')
+            ax_size.set_title('Size curve')
+            self.chart_axes = (ax_week, ax_soh, ax_size)
+            fig.tight_layout()
+            self.chart_canvas = FigureCanvasTkAgg(fig, master=self.chart_window)
+            self.chart_canvas.get_tk_widget().pack(fill='both', expand=True)
+        self._update_chart()
+        self.chart_window.lift()
+
+    def _update_chart(self):
+        if self.chart_window is None or not self.chart_window.winfo_exists():
+            return
+        title, series, soh, sizes = self._chart_values()
+        ax_week, ax_soh, ax_size = self.chart_axes
+        x = list(range(len(series)))
+        if len(self.chart_sales.get_xdata()) != len(x):
+            step = -(-len(x) // 13)
+            ax_week.set_xticks(x[::step])
+            ax_week.set_xticklabels(self.engine.weeks[::step])
+            ax_week.set_xlim(-0.5, len(x) - 0.5)
+        self.chart_sales.set_data(x, series)
+        self.chart_soh.set_data(x, [soh]*len(series))
+        ax_week.set_ylim(0, max(max(series), 1)*1.15)
+        ax_soh.set_ylim(0, max(soh, 1)*1.15)
+        ax_week.set_title(f"{title}: weekly sales vs SOH")
+        heights = [sizes.get(sz,0) for sz in self.chart_sizes]
+        for bar, h in zip(self.chart_bars, heights):
+            bar.set_height(h)
+        ax_size.set_ylim(0, max(heights + [1])*1.15)
+        self.chart_canvas.draw_idle()
 
     def _on_store_double_click(self, event):
         item = self.store_tree.selection()
         if not item:
             return
         store = self.store_tree.item(item, "values")[0]
+        if self.overview:
+            # The overview rows cover every article, so open the store's own view with all its articles
+            if store in self.stores:
+                self.store_idx = self.stores.index(store)
+                self._toggle_store_mode()
+            return
         art = self.articles[self.idx]
-        sales_rows = self.data[(self.data['article'] == art) & (self.data['store'] == store)]
-        inv_rows = self.inv_data[(self.inv_data['article'] == art) & (self.inv_data['store'] == store)]
-        sales_group = sales_rows.groupby(['color','size'])['qty'].sum().reset_index()
-        inv_group = inv_rows.groupby(['color','size'])['soh'].sum().reset_index()
-        merged = pd.merge(sales_group, inv_group, on=['color','size'], how='outer').fillna(0)
-        merged = merged[(merged['qty'] > 0) | (merged['soh'] > 0)]
+        rows = self.engine.store_drilldown(store, art)
         popup = tk.Toplevel(self)
         popup.title(f"{art} - {store} Details")
         popup.geometry(f"{min(600, self.winfo_screenwidth()//2)}x{min(400, self.winfo_screenheight()//2)}")
@@ -387,11 +741,134 @@ class AllInOneApp(tk.Tk):
             tree.heading(c, text=c, anchor='center')
             tree.column(c, width=120 if c in ('Color','Size') else 80, anchor='center')
         tree.pack(fill='both', expand=True, padx=10, pady=10)
-        for _, row in merged.iterrows():
-            tree.insert('', 'end', values=(row['color'], row['size'], int(row['qty']), int(row['soh'])))
+        for color, size, qty, soh in rows:
+            tree.insert('', 'end', values=(color, size, int(qty), int(soh)))
         ttk.Button(popup, text="Close", style='Accent.TButton', command=popup.destroy).pack(pady=6)
 
+    def _export_article(self):
+        if self.store_mode or self.overview:
+            messagebox.showwarning("No Article", "Open an article to export it.")
+            return
+        art, week, engine = self.articles[self.idx], self.week, self.engine
+        file_path = filedialog.asksaveasfilename(defaultextension=".xlsx", filetypes=[("Excel files", "*.xlsx")],
+                                                 initialfile=f"{art}_{week}.xlsx".replace(' ', '_'))
+        if not file_path:
+            return
+        self.jobs.submit(f"Export {art}", lambda path, progress: write_article_breakdowns(engine, [art], path, week, progress), file_path)
+
+    def _export_all(self):
+        articles, week, engine = self.engine.rankings(self.week), self.week, self.engine
+        if not articles:
+            messagebox.showwarning("No Data", "No data to export.")
+            return
+        file_path = filedialog.asksaveasfilename(defaultextension=".xlsx", filetypes=[("Excel files", "*.xlsx")],
+                                                 initialfile=f"all_articles_{week}.xlsx".replace(' ', '_'))
+        if not file_path:
+            return
+        self.jobs.submit("Export all articles", lambda path, progress: write_article_breakdowns(engine, articles, path, week, progress), file_path)
+
+    def _update_data_label(self, status=''):
+        loaded = time.strftime('%H:%M', time.localtime(self.engine.loaded_at))
+        soh = f", SOH {self.engine.inv_history.source(self.engine.inv_key)}" if self.engine.inv_key else ''
+        self.data_label.config(text=f"Data v{self.engine.version} ({loaded}), {len(self.engine.weeks)} weeks{soh}{status}")
+
+    def _update_inventory_choices(self):
+        engine = self.engine
+        # The data server only serves its newest SOH snapshot, so a client cannot pin an older one
+        self.inv_box.config(values=[engine.inv_history.source(k) for k in engine.inv_keys],
+                            state='disabled' if self.client is not None else 'readonly')
+        if engine.inv_key:
+            self.inv_box.current(engine.inv_keys.index(engine.inv_key))
+
+    def _poll_reload(self):
+        # The next snapshot is built on the reload thread; it is only swapped in here, on the Tk thread,
+        # so a render always sees one complete snapshot and the UI never waits for a reload
+        self.reload_changes |= self.watcher.poll()
+        future = self.reload_future
+        if future is not None and future.done():
+            self.reload_future = None
+            try:
+                self._apply_engine(future.result())
+            except Exception as e:
+                logging.error(f"Reload failed: {e}")
+                self.window = self.engine.window
+                self.window_var.set(str(self.window))
+                self._update_inventory_choices()
+                self._update_data_label(' - reload failed, see error log')
+        self._start_reload()
+        self.after(WATCH_POLL_MS, self._poll_reload)
+
+    def _start_reload(self):
+        if self.reload_future is not None or not (self.reload_changes or self.window != self.engine.window or self.inv_target):
+            return
+        engine, changed, window, inv_target, client = self.engine, self.reload_changes, self.window, self.inv_target, self.client
+        following = engine.inv_key == (engine.inv_keys[-1] if engine.inv_keys else None)
+        self.reload_changes, self.inv_target = set(), None
+
+        def next_engine():
+            if client is not None:
+                nxt = client.engine(window) if changed or window != engine.window else engine
+            elif SHARED_DATASET and following and inv_target is None and (changed or window != engine.window):
+                # The first instance to see new data builds and publishes it; the others attach to that
+                def build():
+                    nxt = engine.refreshed(changed) if changed else engine
+                    return (nxt if nxt.window == window else nxt.with_window(window)).build()
+                return attach_or_publish(window, engine.db, build)
+            else:
+                nxt = engine.refreshed(changed) if changed else engine
+            if inv_target is not None and inv_target != nxt.inv_key:
+                nxt = nxt.with_inventory(inv_target)
+            return (nxt if nxt.window == window else nxt.with_window(window)).build()
+        self.reload_future = self.reload_pool.submit(next_engine)
+        self._update_data_label(' - updating...')
+
+    def _set_window(self, window):
+        self.window = window
+        self._start_reload()
+
+    def _set_inventory(self, pos):
+        # Picking the newest snapshot means the view follows new SOH files again; any older one stays pinned
+        if 0 <= pos < len(self.engine.inv_keys) and self.engine.inv_keys[pos] != self.engine.inv_key:
+            self.inv_target = self.engine.inv_keys[pos]
+            self._start_reload()
+
+    def _apply_engine(self, engine):
+        # Swap in the new snapshot but stay on the same article/store and week
+        art = self.articles[self.idx] if self.articles else None
+        store = self.stores[self.store_idx] if self.stores else None
+        weeks_changed = engine.weeks != self.engine.weeks
+        self.engine = engine
+        if weeks_changed:
+            if self.week not in engine.weeks:
+                self.week = 'Overall'
+            self._build_week_buttons()
+            self._set_store_article_columns(self.store_article_tree)
+        self.articles = engine.rankings(self.week)
+        self.stores = engine.rankings(self.week, by='store')
+        self.idx = self.articles.index(art) if art in self.articles else min(self.idx, max(len(self.articles)-1, 0))
+        self.store_idx = self.stores.index(store) if store in self.stores else min(self.store_idx, max(len(self.stores)-1, 0))
+        self._update_inventory_choices()
+        self._update_data_label()
+        self._show()
+        if self.shrinkage_window is not None and self.shrinkage_window.winfo_exists():
+            self._show_shrinkage()
+
+    def _on_close(self):
+        if self.jobs.busy():
+            if not messagebox.askyesno("Exports Running", "Exports are still running. Cancel them and quit?"):
+                return
+            self.jobs.cancel_all()
+            self.jobs.thread.join(timeout=5)
+        # Only once quitting is confirmed, so an app that stays open keeps reloading
+        self.watcher.stop()
+        self.reload_pool.shutdown(wait=False, cancel_futures=True)
+        self.destroy()
+
     def _prev(self):
+        if self.store_mode:
+            self.store_idx = max(self.store_idx-1, 0)
+            self._show()
+            return
         if self.overview:
             return
         if self.idx > 0:
@@ -401,6 +878,10 @@ class AllInOneApp(tk.Tk):
         self._show()
 
     def _next(self):
+        if self.store_mode:
+            self.store_idx = min(self.store_idx+1, len(self.stores)-1)
+            self._show()
+            return
         if self.overview:
             self.overview = False
             self.idx = 0
@@ -409,24 +890,39 @@ class AllInOneApp(tk.Tk):
         self._show()
 
     def _first(self):
-        self.overview = True
+        if self.store_mode:
+            self.store_idx = 0
+        else:
+            self.overview = True
         self._show()
 
     def _last(self):
-        self.overview = False
-        self.idx = len(self.articles)-1
+        if self.store_mode:
+            self.store_idx = len(self.stores)-1
+        else:
+            self.overview = False
+            self.idx = len(self.articles)-1
         self._show()
 
     def _set_week(self, w):
         self.week = w
-        if not self.overview:
-            totals = self.total_qty if w=='Overall' else {a:self.article_week_qty.get((a,w),0) for a in self.articles}
-            self.articles = sorted(totals, key=totals.get, reverse=True)
+        if self.store_mode:
+            self.stores = self.engine.rankings(w, by='store')
+            self.store_idx = 0
+        elif not self.overview:
+            self.articles = self.engine.rankings(w)
             self.idx = 0
         self._show()
 
     def _search(self):
         term = self.search_var.get().lower()
+        if self.store_mode:
+            for i,st in enumerate(self.stores):
+                if term in str(st).lower():
+                    self.store_idx = i
+                    break
+            self._show()
+            return
         if self.overview:
             return
         for i,a in enumerate(self.articles):
@@ -0,0 +1,666 @@
+import os
+import sys
+import glob
+import time
+from functools import cached_property
+import numpy as np
+import pandas as pd
+from history_store import WeeklyArchive
+from inventory_cube import Dimensions, InventoryCube, reconcile
+
+# Per-user, unlike the data folder every user of a terminal server can write to: engine snapshots are
+# pickles, so only files this user wrote are ever loaded
+CACHE_DIR = os.path.join(os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME')
+                         or os.path.join(os.path.expanduser('~'), '.cache'), 'lazera')
+if getattr(sys, 'frozen', False):
+    # A frozen app can name its own data root before importing this module (weekly.exe reads its bundle);
+    # the variable is inherited by its worker processes, which import this module again
+    APP_ROOT = os.environ.get('ALLINONE_ROOT', r'D:\allinone')
+else:
+    APP_ROOT = os.path.abspath(os.path.dirname(__file__))
+SALES_DIR = os.path.join(APP_ROOT, 'sales data')
+INVENTORY_DIR = os.path.join(APP_ROOT, 'inventory data')
+PENDING_DIR = os.path.join(APP_ROOT, 'pending orders')
+IMAGE_DIR = os.path.join(APP_ROOT, 'images')
+LOGO_PATH = os.path.join(APP_ROOT, 'Lazera Logo-02.png')
+if os.path.normcase(APP_ROOT) == os.path.normcase(getattr(sys, '_MEIPASS', '')):
+    # The bundle may be read-only or, for a onefile build, a temporary extraction; the history built from
+    # the data in it goes to the per-user cache instead, apart from the one kept for the data folder
+    HISTORY_DIR = os.path.join(CACHE_DIR, 'bundle history')
+else:
+    HISTORY_DIR = os.path.join(APP_ROOT, 'history')
+INVENTORY_HISTORY_DIR = os.path.join(HISTORY_DIR, 'inventory')
+PENDING_HISTORY_DIR = os.path.join(HISTORY_DIR, 'pending')
+WINDOW_CHOICES = (4, 5, 8, 13, 26, 52)
+DEFAULT_WINDOW = 5
+
+def week_labels(count):
+    return [f'Week {i}' for i in range(1, count+1)]
+
+# Labels for the default window; an engine's own window is engine.weeks
+WEEKS = week_labels(DEFAULT_WINDOW) + ['Overall']
+
+def find_image_path(article):
+    return next((os.path.join(IMAGE_DIR, f"{article}{ext}") for ext in ['.jpg','.jpeg','.png'] if os.path.exists(os.path.join(IMAGE_DIR, f"{article}{ext}"))), None)
+
+def sales_file_number(path):
+    num = ''.join(filter(str.isdigit, os.path.basename(path)))
+    return int(num if num.isdigit() else -1)
+
+def get_latest_files(directory, pattern, count=5):
+    files = sorted(glob.glob(os.path.join(directory, pattern)))
+    if 'salesdata' in pattern.lower():
+        files = [f for f in files if 'salesdata' in os.path.basename(f).lower()]
+        files.sort(key=sales_file_number)
+    else:
+        files.sort(key=os.path.getmtime)
+    return files[-count:] if count else files
+
+PENDING_PATH = os.path.join(PENDING_DIR, 'PENDING ORDERS.xlsx')
+
+def read_sales_file(path):
+    df = pd.read_excel(path)
+    df.columns = df.columns.str.lower().str.replace(' ', '_')
+    df.rename(columns={'colour':'color','quantity':'qty'}, inplace=True)
+    if all(c in df.columns for c in ['article','store','color','size','qty','asp']):
+        return df[['article','store','color','size','qty','asp']].copy()
+    return None
+
+def label_weeks(frames):
+    # The i-th file of the window is always 'Week i', so shifting the window only relabels frames
+    labelled = [f.assign(week=f'Week {i}') for i, f in enumerate(frames, 1) if f is not None]
+    return pd.concat(labelled, ignore_index=True) if labelled else pd.DataFrame(columns=['article','store','color','size','qty','asp','week'])
+
+def week_key(path):
+    # The whole file name, so two workbooks never share a partition
+    return os.path.splitext(os.path.basename(path))[0]
+
+def sales_order(source, stamp):
+    # Sales weeks go by the number in their file name, as the baseline listed them; mtime breaks ties
+    return [sales_file_number(source), stamp[0]]
+
+def inventory_order(source, stamp):
+    # SOH snapshots go by modification time, the newest last, as the baseline picked its one snapshot
+    return [stamp[0]]
+
+def sync_history(history, files, reader, order):
+    # Ingests every workbook the history has not seen in its current state; one parse per new file
+    history.rekey({key: (week_key(e['source']), order(e['source'], e['stamp'])) for key, e in list(history.manifest.items())
+                   if key != week_key(e['source']) or e.get('order') != order(e['source'], e['stamp'])})
+    ingested = set()
+    for path in files:
+        if os.path.basename(path).startswith('~$'):
+            continue
+        st = os.stat(path)
+        key, stamp = week_key(path), (st.st_mtime_ns, st.st_size)
+        if history.stale(key, stamp):
+            history.put(key, reader(path), os.path.basename(path), stamp, order(os.path.basename(path), stamp))
+            ingested.add(key)
+    return ingested
+
+def sync_sales_history(history):
+    return sync_history(history, get_latest_files(SALES_DIR, 'salesdata*.xlsx', None), read_sales_file, sales_order)
+
+def sync_inventory_history(history):
+    return sync_history(history, get_latest_files(INVENTORY_DIR, '*.xlsx', None), read_inventory_file, inventory_order)
+
+def read_inventory_file(path):
+    if path is None:
+        return pd.DataFrame(columns=['article','store','color','size','soh'])
+    df = pd.read_excel(path)
+    df.columns = df.columns.str.lower().str.replace(' ', '_')
+    df.rename(columns={'quantity':'soh','colour':'color'}, inplace=True)
+    if all(c in df.columns for c in ['article','store','color','size','soh']):
+        return df[['article','store','color','size','soh']].copy()
+    return pd.DataFrame(columns=['article','store','color','size','soh'])
+
+def read_pending_file(path):
+    df = pd.read_excel(path)
+    df.columns = df.columns.str.lower().str.replace(' ', '_')
+    rename_map = {'colour':'color', 'quantity':'pending_qty'}
+    df.rename(columns=rename_map, inplace=True)
+    for col in ['color','size','pending_qty','mrp','article']:
+        if col not in df.columns:
+            df[col] = 0 if col in ['pending_qty','mrp'] else ''
+    return df[['article','color','size','pending_qty','mrp']].copy()
+
+def load_pending_data(history=None):
+    # With a history, the workbook is archived like the weekly ones and only parsed when it changed
+    if not os.path.exists(PENDING_PATH):
+        return pd.DataFrame(columns=['article','color','size','pending_qty','mrp'])
+    if history is None:
+        return read_pending_file(PENDING_PATH)
+    sync_history(history, [PENDING_PATH], read_pending_file, inventory_order)
+    return history.get(week_key(PENDING_PATH))
+
+def sales_parts(frame):
+    # Per-week partial sums; every windowed total is a sum of these, whatever the window length
+    if frame is None:
+        return {}
+    return {
+        'article': frame.groupby('article')['qty'].sum(),
+        'store': frame.groupby('store')['qty'].sum(),
+        'asp_num': (frame['asp']*frame['qty']).groupby(frame['article']).sum(),
+    }
+
+def merge_data(sales_df, inv_df, asp_map):
+    merged = pd.merge(sales_df, inv_df, on=['article','store','color','size'], how='outer')
+    merged['soh'] = merged['soh'].fillna(0)
+    merged['qty'] = merged['qty'].fillna(0)
+    merged['asp'] = merged['asp'].fillna(0)
+    merged['asp_calc'] = merged['article'].map(asp_map)
+    merged['week'] = merged['week'].fillna('Overall')
+    return merged
+
+def week_pivot(data, index, weeks=WEEKS[:-1]):
+    qty = data.pivot_table(index=index, columns='week', values='qty', aggfunc='sum', fill_value=0)
+    return qty.reindex(columns=weeks, fill_value=0)
+
+def build_week_matrix(data, weeks=WEEKS[:-1]):
+    wk = week_pivot(data, 'article', weeks)
+    matrix = wk.to_numpy(dtype=float)
+    change = np.full(len(matrix), np.nan)
+    if len(weeks) > 1:
+        # With a single week there is nothing to compare with, so every change stays unknown
+        prev, last = matrix[:, -2], matrix[:, -1]
+        change = np.divide(last - prev, prev, out=change, where=prev > 0) * 100
+    return {a: i for i, a in enumerate(wk.index)}, matrix, change
+
+def trend_glyphs(pivot):
+    if pivot.shape[1] < 2:
+        return dict.fromkeys(pivot.index, '▬')
+    diff = pivot.iloc[:, -1].to_numpy() - pivot.iloc[:, -2].to_numpy()
+    return dict(zip(pivot.index, np.select([diff > 0, diff < 0], ['▲', '▼'], '▬').tolist()))
+
+def build_store_index(data, inv, weeks=WEEKS[:-1]):
+    qty = week_pivot(data, ['store','article'], weeks)
+    table = qty.join(inv.groupby(['store','article'])['soh'].sum(), how='outer').fillna(0)
+    table['total'] = table[weeks].sum(axis=1)
+    moved = table['total'] + table['soh']
+    table['sell_through'] = (table['total'] / moved.where(moved > 0)).fillna(0) * 100
+    table = table.sort_values('total', ascending=False)
+    cols = weeks + ['total','soh','sell_through']
+    index = {}
+    for store, g in table.groupby(level='store', sort=False):
+        index[store] = list(zip(g.index.get_level_values('article'), *(g[c].tolist() for c in cols)))
+    return index
+
+def build_article_summary(data, inv, pending, weeks=WEEKS[:-1]):
+    wk = week_pivot(data, 'article', weeks)
+    soh = inv.groupby('article')['soh'].sum().to_dict()
+    pend = pending.groupby('article')['pending_qty'].sum().to_dict()
+    stocked = inv[inv['soh']>0].groupby('article')['store'].agg(set).to_dict()
+    selling = data[data['qty']>0].groupby('article')['store'].agg(set).to_dict()
+    sizes = {}
+    for (art, size), qty in data.groupby(['article','size'])['qty'].sum().items():
+        sizes.setdefault(art, {})[size] = qty
+    summary = {}
+    for art in wk.index.union(pd.Index(list(soh))):
+        weekly = wk.loc[art].tolist() if art in wk.index else [0]*len(weeks)
+        with_stock = stocked.get(art, set())
+        summary[art] = {
+            'weeks': weekly,
+            'soh': soh.get(art, 0),
+            'pending': pend.get(art, 0),
+            'stores_stocked': len(with_stock),
+            'stores_selling': len(selling.get(art, set())),
+            'zero_sale_stores': len(with_stock - selling.get(art, set())),
+            'sizes': sizes.get(art, {}),
+        }
+    return summary
+
+def _dense_colorsize(frame):
+    ci, colors = pd.factorize(frame.index.get_level_values('color'), sort=True)
+    si, sizes = pd.factorize(frame.index.get_level_values('size'), sort=True)
+    cube = np.zeros((frame.shape[1], len(colors), len(sizes)))
+    cube[:, ci, si] = frame.to_numpy(dtype=float).T
+    return colors.tolist(), sizes.tolist(), cube
+
+def build_colorsize_index(data, inv, pending):
+    keys = ['article','color','size']
+    t = pd.concat([data.groupby(keys)['qty'].sum(), inv.groupby(keys)['soh'].sum(), pending.groupby(keys)['pending_qty'].sum()], axis=1).fillna(0)
+    index = {art: _dense_colorsize(g.droplevel('article')) for art, g in t.groupby(level='article')}
+    index[None] = _dense_colorsize(t.groupby(level=['color','size']).sum())
+    return index
+
+def build_week_colorsize_index(data, inv, pending, weeks):
+    # The same cubes with one week's sales each; SOH and pending are the current stock either way
+    return {w: build_colorsize_index(data[data['week'] == w], inv, pending) for w in weeks}
+
+def build_overview(data, inv, pending, weeks=WEEKS[:-1]):
+    data = data.assign(value=data['qty'] * data['asp_calc'].fillna(0))
+    soh = {k: inv.groupby(k)['soh'].sum() for k in ('store','color','size')}
+    soh['detail'] = inv.groupby(['color','size'])['soh'].sum()
+    pend = {k: pending.groupby(k)['pending_qty'].sum() for k in ('color','size')}
+    pend['detail'] = pending.groupby(['color','size'])['pending_qty'].sum()
+    layout = {
+        'store': ('store', ['qty','soh','value','trend']),
+        'color': ('color', ['qty','pending_qty','soh','value']),
+        'size': ('size', ['qty','pending_qty','soh','value']),
+        'detail': (['color','size'], ['qty','pending_qty','soh']),
+    }
+    totals = {'inventory': inv['soh'].sum(), 'pending': pending['pending_qty'].sum()}
+    store_trend = trend_glyphs(week_pivot(data, 'store', weeks))
+    overview = {}
+    for w in weeks + ['Overall']:
+        dfw = data if w=='Overall' else data[data['week']==w]
+        view = dict(totals, sales=dfw['qty'].sum(), revenue=dfw['value'].sum())
+        for tbl, (key, cols) in layout.items():
+            t = dfw.groupby(key)[['qty','value']].sum().join(soh[tbl], how='outer')
+            if tbl in pend:
+                t = t.join(pend[tbl], how='outer')
+            t = t.fillna(0).sort_values('qty', ascending=False).reset_index()
+            if tbl=='store':
+                t['trend'] = t['store'].map(store_trend).fillna('▬')
+            names = key if isinstance(key, list) else [key]
+            view[tbl] = list(t[names + cols].itertuples(index=False, name=None))
+        overview[w] = view
+    return overview
+
+class DataEngine:
+    # Loads the weekly workbooks once and answers every screen's queries from cached aggregates.
+    # Aggregates are built lazily on first use; call build() to force them all up front, after which the
+    # engine is a read-only snapshot. New data never mutates a snapshot: refreshed() returns the next version.
+    def __init__(self, sales=None, inv=None, pending=None, version=1, window=DEFAULT_WINDOW, history=None,
+                 inv_history=None, inv_key=None, db=None):
+        self.version = version
+        self.db = db
+        self.window = window
+        self.loaded_at = time.time()
+        if history is not None:
+            self.history = history
+        if inv_history is not None:
+            self.inv_history = inv_history
+        if inv_key is not None:
+            self.inv_key = inv_key
+        if sales is not None:
+            self.sales = sales
+            self.sales_keys = sorted(set(sales['week']) - {'Overall'}, key=lambda w: int(w.split()[-1]))
+            self.sales_frames = [sales[sales['week'] == w].drop(columns='week') for w in self.sales_keys]
+        if inv is not None:
+            self.inv = inv
+        if pending is not None:
+            self.pending = pending
+        self._breakdowns = {}
+        self._drilldowns = {}
+
+    def __setattr__(self, name, value):
+        if self.__dict__.get('_frozen'):
+            raise AttributeError(f"DataEngine v{self.version} is a read-only snapshot")
+        super().__setattr__(name, value)
+
+    @cached_property
+    def history(self):
+        return WeeklyArchive(HISTORY_DIR)
+
+    @cached_property
+    def sales_keys(self):
+        sync_sales_history(self.history)
+        return self.history.keys()[-self.window:]
+
+    @cached_property
+    def weeks(self):
+        return week_labels(len(self.sales_keys))
+
+    @cached_property
+    def sales_frames(self):
+        return [self.history.get(k) for k in self.sales_keys]
+
+    @cached_property
+    def sales_stamps(self):
+        # Which version of each week's workbook the frames hold; taken on the thread that syncs the history
+        return [self.history.stamp(k) for k in self.sales_keys]
+
+    @cached_property
+    def _sales_parts(self):
+        return [sales_parts(f) for f in self.sales_frames]
+
+    @cached_property
+    def sales(self):
+        return label_weeks(self.sales_frames)
+
+    @cached_property
+    def inv_history(self):
+        return WeeklyArchive(INVENTORY_HISTORY_DIR, measures=('soh',))
+
+    @cached_property
+    def inv_keys(self):
+        sync_inventory_history(self.inv_history)
+        return self.inv_history.keys()
+
+    @cached_property
+    def inv_key(self):
+        # The SOH snapshot every inventory figure is taken from; the newest one unless chosen otherwise
+        return self.inv_keys[-1] if self.inv_keys else None
+
+    @cached_property
+    def inv(self):
+        return self.inv_snapshot(self.inv_key)
+
+    @cached_property
+    def inv_stamp(self):
+        return self.inv_history.stamp(self.inv_key) if self.inv_key is not None else None
+
+    def inv_snapshot(self, key):
+        frame = self.inv_history.get(key) if key is not None else None
+        return frame if frame is not None else read_inventory_file(None)
+
+    @cached_property
+    def dims(self):
+        # Sales values are coded first, so sales and every SOH snapshot share one set of dimension codes
+        dims = Dimensions()
+        for frame in self.sales_frames:
+            if frame is not None:
+                dims.cell_keys(frame)
+        return dims
+
+    @cached_property
+    def inventory_cube(self):
+        cube = InventoryCube(self.dims)
+        for key in self.inv_keys:
+            cube = cube.added(key, self.inv_snapshot(key))
+        return cube
+
+    @cached_property
+    def reconciliation(self):
+        # Inferred receipts for every snapshot week with sales on record, including weeks outside the window.
+        # A snapshot is matched to the sales week with the same number in its file name.
+        cube = self.inventory_cube
+        loaded = dict(zip(self.sales_keys, self.sales_frames))
+        weeks = {sales_file_number(e['source']): k for k, e in self.history.manifest.items()}
+        weeks.pop(-1, None)
+        matched = {k: weeks.get(sales_file_number(self.inv_history.manifest[k]['source'])) for k in cube.keys[1:]}
+        sales = {k: loaded[w] if w in loaded else self.history.get(w) for k, w in matched.items() if w is not None}
+        return reconcile(cube, sales, [self.inv_history.source(k) for k in cube.keys])
+
+    @cached_property
+    def pending_history(self):
+        return WeeklyArchive(PENDING_HISTORY_DIR, measures=('pending_qty', 'mrp'), dims=('article', 'color', 'size'))
+
+    @cached_property
+    def pending(self):
+        def load():
+            return load_pending_data(self.pending_history)
+        return self.db.pending(load) if self.db is not None else load()
+
+    @cached_property
+    def sql(self):
+        # This snapshot's rows in the optional SQLite mirror; weeks whose version it has no rows for yet are
+        # ingested from this snapshot's own frames, never over the rows another snapshot reads
+        soh = [(self.inv_key, self.inv_stamp, self.inv)] if self.inv_key is not None else []
+        return self.db.snapshot(zip(self.sales_keys, self.sales_stamps, self.sales_frames), soh)
+
+    def _sum_parts(self, name, keys=()):
+        parts = [p[name] for p in self._sales_parts if p]
+        total = pd.concat(parts).groupby(level=0).sum() if parts else pd.Series(dtype='float64')
+        return total.reindex(total.index.union(pd.Index(keys).unique()), fill_value=0).astype('float64').to_dict()
+
+    @cached_property
+    def _asp_num(self):
+        return self._sum_parts('asp_num')
+
+    @cached_property
+    def asp_map(self):
+        return {a: self._asp_num.get(a, 0)/q if q > 0 else 0 for a, q in self._sum_parts('article').items()}
+
+    @cached_property
+    def data(self):
+        return merge_data(self.sales, self.inv, self.asp_map)
+
+    # Windowed sales totals (per article and per store) come from the per-week partial sums, so they never
+    # regroup raw rows. The overview, store index and color/size indexes are still built from the merged
+    # rows of the whole window, once per snapshot.
+    @cached_property
+    def total_qty(self):
+        return self._sum_parts('article', self.inv['article'])
+
+    @cached_property
+    def week_qty(self):
+        return {w: float(p['article'].sum()) for w, p in zip(self.weeks, self._sales_parts) if p}
+
+    @cached_property
+    def article_week_qty(self):
+        return {(a, w): float(q) for w, p in zip(self.weeks, self._sales_parts) if p for a, q in p['article'].items()}
+
+    @cached_property
+    def inv_map(self):
+        return self.inv.groupby('article')['soh'].sum().to_dict()
+
+    @cached_property
+    def store_inv(self):
+        return self.inv.groupby(['article','store'])['soh'].sum().to_dict()
+
+    @cached_property
+    def color_inv(self):
+        return self.inv.groupby(['article','color'])['soh'].sum().to_dict()
+
+    @cached_property
+    def size_inv(self):
+        return self.inv.groupby(['article','size'])['soh'].sum().to_dict()
+
+    @cached_property
+    def pending_total(self):
+        return self.pending.groupby('article')['pending_qty'].sum().to_dict()
+
+    @cached_property
+    def pending_color(self):
+        return self.pending.groupby(['article','color'])['pending_qty'].sum().to_dict()
+
+    @cached_property
+    def pending_size(self):
+        return self.pending.groupby(['article','size'])['pending_qty'].sum().to_dict()
+
+    @cached_property
+    def pending_colorsize(self):
+        return self.pending.groupby(['article','color','size'])['pending_qty'].sum().to_dict()
+
+    @cached_property
+    def mrp_map(self):
+        return self.pending.set_index('article')['mrp'].to_dict()
+
+    @cached_property
+    def store_index(self):
+        return build_store_index(self.data, self.inv, self.weeks)
+
+    @cached_property
+    def _value(self):
+        return self.data['qty'] * self.data['asp_calc'].fillna(0)
+
+    @cached_property
+    def store_qty(self):
+        return self._sum_parts('store', self.inv['store'])
+
+    @cached_property
+    def store_week_qty(self):
+        return {(st, w): float(q) for w, p in zip(self.weeks, self._sales_parts) if p for st, q in p['store'].items()}
+
+    @cached_property
+    def store_value(self):
+        return self._value.groupby(self.data['store']).sum().to_dict()
+
+    @cached_property
+    def store_week_value(self):
+        return self._value.groupby([self.data['store'], self.data['week']]).sum().to_dict()
+
+    @cached_property
+    def store_soh(self):
+        return self.inv.groupby('store')['soh'].sum().to_dict()
+
+    @cached_property
+    def overview(self):
+        return build_overview(self.data, self.inv, self.pending, self.weeks)
+
+    @cached_property
+    def article_summary(self):
+        return build_article_summary(self.data, self.inv, self.pending, self.weeks)
+
+    @cached_property
+    def week_matrix(self):
+        return build_week_matrix(self.data, self.weeks)
+
+    @cached_property
+    def store_trend(self):
+        return trend_glyphs(week_pivot(self.data, ['article','store'], self.weeks))
+
+    @cached_property
+    def colorsize_index(self):
+        return build_colorsize_index(self.data, self.inv, self.pending)
+
+    @cached_property
+    def week_colorsize_index(self):
+        return build_week_colorsize_index(self.data, self.inv, self.pending, self.weeks)
+
+    def colorsize(self, key, week='Overall'):
+        # (colors, sizes, qty/SOH/pending cube) of an article, or of every article for key None
+        index = self.colorsize_index if week == 'Overall' else self.week_colorsize_index.get(week, {})
+        return index.get(key, ([], [], np.zeros((3, 0, 0))))
+
+    @cached_property
+    def _article_frames(self):
+        return dict(tuple(self.data.groupby('article')))
+
+    @cached_property
+    def _article_inv_frames(self):
+        return dict(tuple(self.inv.groupby('article')))
+
+    def build(self):
+        # Everything that reads the histories is taken here: they are shared with, and rewritten for, the
+        # next versions, so a built snapshot never reads them again
+        if self.__dict__.get('_frozen'):
+            return self
+        for name in ('total_qty','week_qty','article_week_qty','inv_map','store_inv','color_inv','size_inv',
+                     'pending_total','pending_color','pending_size','pending_colorsize','mrp_map',
+                     'store_index','store_qty','store_week_qty','store_value','store_week_value','store_soh',
+                     'overview','article_summary','week_matrix','store_trend','colorsize_index','week_colorsize_index',
+                     '_sales_parts','_asp_num','weeks','inventory_cube','sales_stamps','inv_stamp','reconciliation'):
+            getattr(self, name)
+        # Article and store screens either query the database or slice the per-article frames
+        for name in (('sql',) if self.db is not None else ('_article_frames','_article_inv_frames')):
+            getattr(self, name)
+        self._frozen = True
+        return self
+
+    def refreshed(self, changed=()):
+        # Returns the engine for what is on disk now. New or changed sales and SOH workbooks are parsed once
+        # into their histories; pending orders are only re-read when that file changed. A view pinned to an
+        # older SOH snapshot stays on it; otherwise it moves to the newest snapshot.
+        changed = {os.path.abspath(p) for p in changed}
+        stale = sync_sales_history(self.history)
+        stale_inv = sync_inventory_history(self.inv_history)
+        inv_keys = self.inv_history.keys()
+        latest = inv_keys[-1] if inv_keys else None
+        pinned = self.inv_key is not None and self.inv_keys and self.inv_key != self.inv_keys[-1] and self.inv_key in inv_keys
+        same_pending = os.path.abspath(PENDING_PATH) not in changed
+        return self._next(self.window, stale, self.inv_key if pinned else latest, stale_inv,
+                          pending=self.pending if same_pending else None)
+
+    def with_window(self, window):
+        return self._next(window, set(), self.inv_key, set(), self.pending)
+
+    def with_inventory(self, inv_key):
+        return self._next(self.window, set(), inv_key, set(), self.pending)
+
+    def _next(self, window, stale, inv_key, stale_inv, pending):
+        # Weeks and SOH snapshots already loaded are carried over; only new ones are read from the histories
+        same_inv = inv_key == self.inv_key and inv_key not in stale_inv
+        engine = DataEngine(inv=self.inv if same_inv else None, pending=pending, version=self.version+1, window=window,
+                            history=self.history, inv_history=self.inv_history, inv_key=inv_key, db=self.db)
+        engine.dims = self.dims
+        engine.inv_keys = self.inv_history.keys()
+        if not stale_inv:
+            cube = self.inventory_cube
+            for key in engine.inv_keys:
+                if key not in cube.keys:
+                    cube = cube.added(key, self.inv_snapshot(key))
+            engine.inventory_cube = cube
+        loaded = {k: (f, part) for k, f, part in zip(self.sales_keys, self.sales_frames, self._sales_parts) if k not in stale}
+        keys = self.history.keys()[-window:]
+        frames, parts = [], []
+        for k in keys:
+            if k in loaded:
+                f, part = loaded[k]
+            else:
+                f = self.history.get(k)
+                part = sales_parts(f)
+            frames.append(f)
+            parts.append(part)
+        engine.sales_keys, engine.sales_frames, engine._sales_parts = keys, frames, parts
+        if keys == self.sales_keys and not stale and same_inv:
+            engine.sales, engine.data = self.sales, self.data
+        return engine
+
+    # --- Query API ---
+    def weekly_pivot(self):
+        if self.sales.empty:
+            return pd.DataFrame()
+        present = [w for w in self.weeks if w in set(self.sales['week'])]
+        pivot = week_pivot(self.sales, 'article', self.weeks)[present].astype(float)
+        pivot['Total'] = pivot.sum(axis=1)
+        return pivot.sort_values('Total', ascending=False)
+
+    def rankings(self, week='Overall', by='article'):
+        if by == 'store':
+            totals = self.store_qty if week == 'Overall' else {s: self.store_week_qty.get((s,week),0) for s in self.store_index}
+            return sorted(self.store_index, key=lambda s: totals.get(s,0), reverse=True)
+        totals = self.total_qty if week == 'Overall' else {a: self.article_week_qty.get((a,week),0) for a in self.total_qty}
+        return sorted(totals, key=totals.get, reverse=True)
+
+    def article_breakdown(self, art, week='Overall', cache=True):
+        key = (art, week)
+        if key in self._breakdowns:
+            return self._breakdowns[key]
+        if self.db is not None:
+            tables = self._sql_breakdown(art, week)
+            if cache:
+                self._breakdowns[key] = tables
+            return tables
+        dfw = self._article_frames.get(art, self.data.iloc[:0])
+        if week != 'Overall':
+            dfw = dfw[dfw['week'] == week]
+        asp = self.asp_map.get(art, 0)
+        tables = {}
+        for tbl, inv_map, pend_map in (('store', self.store_inv, None), ('color', self.color_inv, self.pending_color), ('size', self.size_inv, self.pending_size)):
+            qty_map = dfw.groupby(tbl)['qty'].sum().to_dict()
+            items = [i for (a,i) in inv_map.keys() if a==art]
+            items.sort(key=lambda x: qty_map.get(x,0), reverse=True)
+            if tbl == 'store':
+                tables[tbl] = [(val, qty_map.get(val,0), inv_map.get((art,val),0), qty_map.get(val,0)*asp, self.store_trend.get((art,val),'▬')) for val in items]
+            else:
+                tables[tbl] = [(val, qty_map.get(val,0), pend_map.get((art,val),0), inv_map.get((art,val),0), qty_map.get(val,0)*asp) for val in items]
+        detail = dfw.groupby(['color','size']).agg({'qty':'sum','soh':'sum'}).reset_index()
+        tables['detail'] = [(color, size, qty, self.pending_colorsize.get((art,color,size),0), soh)
+                            for color, size, qty, soh in detail[['color','size','qty','soh']].itertuples(index=False, name=None)]
+        if cache:
+            self._breakdowns[key] = tables
+        return tables
+
+    def _week_keys(self, week):
+        return list(self.sales_keys) if week == 'Overall' else [self.sales_keys[self.weeks.index(week)]]
+
+    def _sql_breakdown(self, art, week):
+        # Same tables as the frame path, from indexed queries on the SQLite mirror
+        keys, asp = self._week_keys(week), self.asp_map.get(art, 0)
+        tables = {'store': [(val, qty, soh, qty*asp, self.store_trend.get((art,val),'▬'))
+                            for val, qty, soh in self.sql.article_totals(art, keys, self.inv_key, 'store')]}
+        for tbl, pend_map in (('color', self.pending_color), ('size', self.pending_size)):
+            tables[tbl] = [(val, qty, pend_map.get((art,val),0), soh, qty*asp)
+                           for val, qty, soh in self.sql.article_totals(art, keys, self.inv_key, tbl)]
+        tables['detail'] = [(color, size, qty, self.pending_colorsize.get((art,color,size),0), soh)
+                            for color, size, qty, soh in self.sql.article_detail(art, keys, self.inv_key, week == 'Overall')]
+        return tables
+
+    def store_drilldown(self, store, article=None):
+        if article is None:
+            return self.store_index.get(store, [])
+        key = (store, article)
+        if key not in self._drilldowns and self.db is not None:
+            self._drilldowns[key] = self.sql.store_article(store, article, self.sales_keys, self.inv_key)
+        if key not in self._drilldowns:
+            sales_rows = self._article_frames.get(article, self.data.iloc[:0])
+            inv_rows = self._article_inv_frames.get(article, self.inv.iloc[:0])
+            sales_group = sales_rows[sales_rows['store'] == store].groupby(['color','size'])['qty'].sum().reset_index()
+            inv_group = inv_rows[inv_rows['store'] == store].groupby(['color','size'])['soh'].sum().reset_index()
+            merged = pd.merge(sales_group, inv_group, on=['color','size'], how='outer').fillna(0)
+            merged = merged[(merged['qty'] > 0) | (merged['soh'] > 0)]
+            self._drilldowns[key] = list(merged[['color','size','qty','soh']].itertuples(index=False, name=None))
+        return self._drilldowns[key]
@@ -0,0 +1,422 @@
+import sys
+import gzip
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+import urllib.request
+import urllib.error
+from collections.abc import Mapping
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote, quote, urlencode
+import numpy as np
+import pandas as pd
+from data_engine import DEFAULT_WINDOW, WINDOW_CHOICES
+from data_watcher import DataWatcher, WATCH_INTERVAL
+from engine_snapshot import snapshot_for
+
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8765
+SERVER_URL = f'http://{SERVER_HOST}:{SERVER_PORT}'
+GZIP_MIN_BYTES = 1024
+RESPONSE_CACHE_SIZE = 4096
+THUMB_MAX_SIZE = 400
+CLIENT_TIMEOUT = 30
+# What the Tk client's screens read up front, in one request: plain dicts, and dicts keyed by (name, week)
+SCREEN_MAPS = ('week_qty', 'overview', 'total_qty', 'asp_map', 'mrp_map', 'inv_map', 'pending_total',
+               'store_qty', 'store_value', 'store_soh')
+SCREEN_PAIRS = ('article_week_qty', 'store_week_qty', 'store_week_value')
+
+def _plain(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return dict(obj) if isinstance(obj, Mapping) else obj.tolist()
+
+def to_json(obj):
+    return json.dumps(obj, default=_plain, separators=(',', ':')).encode()
+
+def screen_data(engine, fp):
+    # JSON keys are always strings, so dicts keyed by tuples or sizes go as [key..., value] rows
+    row, matrix, change = engine.week_matrix
+    return {'fingerprint': fp, 'window': engine.window, 'version': engine.version, 'loaded_at': engine.loaded_at,
+            'weeks': engine.weeks, 'inv_keys': engine.inv_keys, 'inv_key': engine.inv_key,
+            'soh_sources': [engine.inv_history.source(k) for k in engine.inv_keys],
+            **{name: getattr(engine, name) for name in SCREEN_MAPS},
+            **{name: [[*k, v] for k, v in getattr(engine, name).items()] for name in SCREEN_PAIRS},
+            'article_summary': {a: {**s, 'sizes': list(s.get('sizes', {}).items())} for a, s in engine.article_summary.items()},
+            'week_matrix': [row, matrix, change]}
+
+def colorsize_data(engine, key, week='Overall'):
+    colors, sizes, cube = engine.colorsize(key, week)
+    return {'colors': list(colors), 'sizes': list(sizes), 'qty': cube[0], 'soh': cube[1], 'pending': cube[2]}
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class DataService:
+    # Loads the dataset once per window and answers every client from it. The engines are the same
+    # read-only snapshots the app maps at startup; a changed workbook rebuilds them on the watcher thread
+    # and swaps them in, so requests never wait on a rebuild and never see a half-built engine.
+    def __init__(self, windows=(DEFAULT_WINDOW,)):
+        self.lock = threading.Lock()
+        self.data_version = 1
+        self.engines = {w: snapshot_for(w) for w in windows}
+        self.building = {}
+        self.responses = {}
+        self.watcher = DataWatcher()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.watcher.stop()
+
+    def _run(self):
+        while not self.stop_event.wait(WATCH_INTERVAL):
+            if not self.watcher.poll():
+                continue
+            try:
+                engines = {w: snapshot_for(w) for w in list(self.engines)}
+            except Exception as e:
+                logging.error(f"Reload failed: {e}")
+                continue
+            with self.lock:
+                self.engines.update(engines)
+                self.responses.clear()
+                self.data_version += 1
+            logging.info(f"data v{self.data_version} loaded")
+
+    def snapshot(self, window):
+        with self.lock:
+            if window in self.engines:
+                return self.engines[window]
+            building = self.building.setdefault(window, threading.Lock())
+        # One build per window: requests that arrive while it runs wait for it and take its engine
+        with building:
+            with self.lock:
+                if window in self.engines:
+                    return self.engines[window]
+            fp_engine = snapshot_for(window)
+            with self.lock:
+                return self.engines.setdefault(window, fp_engine)
+
+    def respond(self, path, query):
+        # (etag, body, content type) for one GET, cached per engine fingerprint
+        window = self._window(query)
+        fp, engine = self.snapshot(window)
+        key = (fp, path, tuple(sorted((k, tuple(v)) for k, v in query.items())))
+        cached = self.responses.get(key)
+        if cached is None:
+            body, ctype = self._render(engine, fp, window, path, query)
+            cached = (f'"{hashlib.sha1(body).hexdigest()[:24]}"', body, ctype, {})
+            with self.lock:
+                if len(self.responses) >= RESPONSE_CACHE_SIZE:
+                    self.responses.clear()
+                self.responses[key] = cached
+        return cached
+
+    def _window(self, query):
+        try:
+            window = int(query.get('window', [DEFAULT_WINDOW])[0])
+        except ValueError:
+            raise HttpError(400, 'window must be a number of weeks')
+        if window not in WINDOW_CHOICES:
+            raise HttpError(400, f"window must be one of {', '.join(map(str, WINDOW_CHOICES))}")
+        return window
+
+    def _render(self, engine, fp, window, path, query):
+        week = query.get('week', ['Overall'])[0]
+        if week != 'Overall' and week not in engine.weeks:
+            raise HttpError(400, f"unknown week {week!r}")
+        parts = [unquote(p) for p in path.strip('/').split('/')]
+        if parts[:1] != ['api'] or len(parts) < 2:
+            raise HttpError(404, 'not found')
+        route, args = parts[1], parts[2:]
+        if route == 'meta' and not args:
+            soh = engine.inv_history.source(engine.inv_key) if engine.inv_key else None
+            return to_json({'fingerprint': fp, 'data_version': self.data_version, 'version': engine.version, 'window': engine.window,
+                            'windows': WINDOW_CHOICES, 'weeks': engine.weeks, 'loaded_at': engine.loaded_at, 'soh': soh}), 'application/json'
+        if route == 'rankings' and not args:
+            by = query.get('by', ['article'])[0]
+            if by not in ('article', 'store'):
+                raise HttpError(400, "by must be 'article' or 'store'")
+            return to_json(engine.rankings(week, by=by)), 'application/json'
+        if route == 'overview' and not args:
+            return to_json(engine.overview[week]), 'application/json'
+        if route == 'overview' and args == ['colorsize']:
+            return to_json(colorsize_data(engine, None, week)), 'application/json'
+        if route == 'screen' and not args:
+            return to_json(screen_data(engine, fp)), 'application/json'
+        if route == 'reconciliation' and not args:
+            frame = engine.reconciliation
+            return to_json({'columns': list(frame.columns), 'data': frame.to_numpy(dtype=object).tolist()}), 'application/json'
+        if route == 'articles' and len(args) in (1, 2):
+            art = args[0]
+            if art not in engine.total_qty:
+                raise HttpError(404, f"unknown article {art!r}")
+            if len(args) == 1:
+                return to_json({'article': art, 'sales': engine.total_qty.get(art, 0), 'asp': engine.asp_map.get(art, 0),
+                                'mrp': engine.mrp_map.get(art, 0), **engine.article_summary.get(art, {})}), 'application/json'
+            if args[1] == 'breakdown':
+                return to_json(engine.article_breakdown(art, week, cache=False)), 'application/json'
+            if args[1] == 'colorsize':
+                return to_json(colorsize_data(engine, art, week)), 'application/json'
+        if route == 'stores' and len(args) in (1, 2):
+            store = args[0]
+            if store not in engine.store_index:
+                raise HttpError(404, f"unknown store {store!r}")
+            if len(args) == 1:
+                return to_json(engine.store_drilldown(store, query.get('article', [None])[0])), 'application/json'
+            if args[1] == 'articles':
+                return to_json(engine.store_index[store]), 'application/json'
+        if route == 'thumbnails' and len(args) == 1:
+            from pdf_export import thumbnail_png
+            art = args[0]
+            # Only articles in the data, so an encoded path can never reach the image lookup
+            if art not in engine.total_qty or any(c in art for c in ('/', '\\')) or '..' in art:
+                raise HttpError(404, f"unknown article {art!r}")
+            try:
+                size = min(int(query.get('size', [100])[0]), THUMB_MAX_SIZE)
+            except ValueError:
+                raise HttpError(400, 'size must be a number of pixels')
+            if size < 1:
+                raise HttpError(400, 'size must be at least 1 pixel')
+            return thumbnail_png(art, (size, size)), 'image/png'
+        raise HttpError(404, 'not found')
+
+def conditional_response(cached, headers):
+    # 304 when the client already has this version, otherwise the body, gzipped for clients that accept it.
+    # Header names are looked up in lower case, which also matches http.server's case-insensitive headers.
+    etag, body, ctype, variants = cached
+    out = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    if etag in [t.strip() for t in (headers.get('if-none-match') or '').split(',')]:
+        return 304, out, b''
+    out['Content-Type'] = ctype
+    if not ctype.startswith('image/') and len(body) >= GZIP_MIN_BYTES and 'gzip' in (headers.get('accept-encoding') or ''):
+        # Compressed once per cached response, then reused for every client that accepts gzip
+        if 'gzip' not in variants:
+            variants['gzip'] = gzip.compress(body, 6)
+        body, out['Content-Encoding'] = variants['gzip'], 'gzip'
+    return 200, out, body
+
+def http_response(service, target, headers):
+    # (status, headers, body) for one GET under /api/; shared by the threaded server and the web dashboard
+    url = urlsplit(target)
+    try:
+        cached = service.respond(url.path, parse_qs(url.query))
+    except HttpError as e:
+        return e.status, {'Content-Type': 'application/json'}, to_json({'error': str(e)})
+    except Exception as e:
+        logging.error(f"{target} failed: {e}")
+        return 500, {'Content-Type': 'application/json'}, to_json({'error': 'internal error'})
+    return conditional_response(cached, headers)
+
+class DataRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'LazeraData/1'
+
+    def do_GET(self):
+        status, headers, body = http_response(self.server.service, self.path, self.headers)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+def serve(host=SERVER_HOST, port=SERVER_PORT, windows=(DEFAULT_WINDOW,)):
+    server = ThreadingHTTPServer((host, port), DataRequestHandler)
+    server.daemon_threads = True
+    server.service = DataService(windows)
+    return server
+
+class _Sources:
+    # The part of the SOH history the client shows: the workbook each snapshot came from
+    def __init__(self, sources):
+        self.sources = sources
+
+    def source(self, key):
+        return self.sources.get(key, key)
+
+class _Lookup:
+    # dict.get over items fetched from the server the first time they are asked for
+    def __init__(self, fetch):
+        self.fetch = fetch
+        self.items = {}
+
+    def get(self, key, default=None):
+        if key not in self.items:
+            try:
+                self.items[key] = self.fetch(key)
+            except urllib.error.HTTPError as e:
+                if e.code != 404:
+                    raise
+                self.items[key] = None
+        value = self.items[key]
+        return default if value is None else value
+
+class RemoteEngine:
+    # Stands in for a DataEngine in client mode. The aggregates every screen reads come in one JSON
+    # request; rankings, breakdowns, store rows and colour/size grids are fetched when first shown and
+    # kept for this data version. Only JSON crosses the wire, so a client runs no code from the server
+    # and holds only what it has shown.
+    def __init__(self, client, window, data):
+        self.client = client
+        self.db = None
+        self.window = window
+        self.fingerprint = data['fingerprint']
+        self.version = data['version']
+        self.loaded_at = data['loaded_at']
+        self.weeks = data['weeks']
+        self.inv_keys = data['inv_keys']
+        self.inv_key = data['inv_key']
+        self.inv_history = _Sources(dict(zip(self.inv_keys, data['soh_sources'])))
+        for name in SCREEN_MAPS:
+            setattr(self, name, data[name])
+        for name in SCREEN_PAIRS:
+            setattr(self, name, {tuple(k): v for *k, v in data[name]})
+        self.article_summary = {a: {**s, 'sizes': dict(s['sizes'])} for a, s in data['article_summary'].items()}
+        row, matrix, change = data['week_matrix']
+        self.week_matrix = (row, np.array(matrix, dtype=float).reshape(len(row), len(self.weeks)), np.array(change, dtype=float))
+        self.store_index = _Lookup(lambda store: [tuple(r) for r in self._get(f'/api/stores/{quote(store, safe="")}/articles')])
+        self.cache = {}
+
+    def _get(self, path, **params):
+        return json.loads(self.client.get(path, {'window': self.window, **params})[0])
+
+    def _cached(self, key, fetch):
+        if key not in self.cache:
+            self.cache[key] = fetch()
+        return self.cache[key]
+
+    def colorsize(self, key, week='Overall'):
+        def fetch():
+            path = '/api/overview/colorsize' if key is None else f'/api/articles/{quote(key, safe="")}/colorsize'
+            try:
+                cs = self._get(path, week=week)
+            except urllib.error.HTTPError as e:
+                if e.code != 404:
+                    raise
+                return [], [], np.zeros((3, 0, 0))
+            cube = np.array([cs['qty'], cs['soh'], cs['pending']], dtype=float).reshape(3, len(cs['colors']), len(cs['sizes']))
+            return cs['colors'], cs['sizes'], cube
+        return self._cached(('colorsize', key, week), fetch)
+
+    def build(self):
+        return self
+
+    def rankings(self, week='Overall', by='article'):
+        return self._cached(('rankings', week, by), lambda: self._get('/api/rankings', week=week, by=by))
+
+    def article_breakdown(self, art, week='Overall', cache=True):
+        def fetch():
+            tables = self._get(f'/api/articles/{quote(art, safe="")}/breakdown', week=week)
+            return {k: [tuple(r) for r in rows] for k, rows in tables.items()}
+        return self._cached(('breakdown', art, week), fetch) if cache else fetch()
+
+    def store_drilldown(self, store, article=None):
+        params = {'article': article} if article is not None else {}
+        return self._cached(('drilldown', store, article), lambda: [tuple(r) for r in self._get(f'/api/stores/{quote(store, safe="")}', **params)])
+
+    @property
+    def reconciliation(self):
+        def fetch():
+            recon = self._get('/api/reconciliation')
+            return pd.DataFrame(recon['data'], columns=recon['columns']).infer_objects()
+        return self._cached('reconciliation', fetch)
+
+class DataClient:
+    # The app's side of the service: one RemoteEngine per window, replaced only when the server's data
+    # changed (ETag / If-None-Match on the screen data)
+    def __init__(self, url=SERVER_URL):
+        self.url = url.rstrip('/')
+        self.engines = {}
+
+    def get(self, path, params=None, etag=None):
+        # path segments come already quoted
+        url = f"{self.url}{path}" + (f"?{urlencode(params)}" if params else '')
+        request = urllib.request.Request(url, headers={'Accept-Encoding': 'gzip', **({'If-None-Match': etag} if etag else {})})
+        try:
+            with urllib.request.urlopen(request, timeout=CLIENT_TIMEOUT) as response:
+                body = response.read()
+                if response.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                return body, response.headers.get('ETag')
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None, etag
+            raise
+
+    def meta(self, window=DEFAULT_WINDOW):
+        return json.loads(self.get('/api/meta', {'window': window})[0])
+
+    def engine(self, window=DEFAULT_WINDOW):
+        etag, engine = self.engines.get(window, (None, None))
+        body, etag = self.get('/api/screen', {'window': window}, etag)
+        if body is None:
+            return engine
+        engine = RemoteEngine(self, window, json.loads(body))
+        self.engines[window] = (etag, engine)
+        return engine
+
+class ServerWatcher:
+    # Stands in for DataWatcher in client mode: reports a change whenever the server loaded new data
+    def __init__(self, client, interval=WATCH_INTERVAL):
+        self.client = client
+        self.interval = interval
+        self.changed = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        seen = None
+        while not self.stop_event.wait(self.interval):
+            try:
+                version = self.client.meta()['data_version']
+            except (OSError, ValueError) as e:
+                logging.error(f"Data server unreachable: {e}")
+                continue
+            if seen is not None and version != seen:
+                self.changed.set()
+            seen = version
+
+    def poll(self):
+        if self.changed.is_set():
+            self.changed.clear()
+            return {self.client.url}
+        return set()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the Lazera aggregates to app clients over local HTTP/JSON.')
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('-n', '--window', type=int, choices=WINDOW_CHOICES, action='append',
+                        help=f'window(s) in weeks to load up front, repeatable (default: {DEFAULT_WINDOW})')
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+    start = time.time()
+    server = serve(args.host, args.port, tuple(args.window or [DEFAULT_WINDOW]))
+    logging.info(f"serving http://{args.host}:{args.port}/api/ (ready in {time.time() - start:.1f}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.service.stop()
+        server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
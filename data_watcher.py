@@ -0,0 +1,56 @@
+import os
+import queue
+import threading
+from data_engine import SALES_DIR, INVENTORY_DIR, PENDING_DIR
+
+WATCH_DIRS = (SALES_DIR, INVENTORY_DIR, PENDING_DIR)
+WATCH_INTERVAL = 5
+WATCH_POLL_MS = 1000
+
+def scan(dirs):
+    # One stat per workbook; Excel's '~$' lock files are ignored
+    found = {}
+    for directory in dirs:
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.lower().endswith('.xlsx') and not entry.name.startswith('~$') and entry.is_file():
+                        st = entry.stat()
+                        found[entry.path] = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            pass
+    return found
+
+class DataWatcher:
+    # Polls the input folders and queues the set of workbooks that were added, changed or removed.
+    # A change is only reported once two scans agree, so half-copied files are not picked up.
+    def __init__(self, dirs=WATCH_DIRS, interval=WATCH_INTERVAL):
+        self.dirs = dirs
+        self.interval = interval
+        self.changes = queue.Queue()
+        self.stop_event = threading.Event()
+        self.snapshot = scan(dirs)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        reported = last = self.snapshot
+        while not self.stop_event.wait(self.interval):
+            now = scan(self.dirs)
+            if now != last:
+                last = now
+                continue
+            if now != reported:
+                self.changes.put({p for p in now.keys() | reported.keys() if now.get(p) != reported.get(p)})
+                reported = now
+
+    def poll(self):
+        changed = set()
+        while True:
+            try:
+                changed |= self.changes.get_nowait()
+            except queue.Empty:
+                return changed
@@ -0,0 +1,221 @@
+import io
+import os
+import sys
+import glob
+import json
+import mmap
+import time
+import pickle
+import struct
+import hashlib
+import functools
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from data_engine import (DataEngine, HISTORY_DIR, INVENTORY_HISTORY_DIR, CACHE_DIR, PENDING_PATH, DEFAULT_WINDOW,
+                         WINDOW_CHOICES, sync_sales_history, sync_inventory_history)
+from collections.abc import Mapping
+from history_store import WeeklyArchive
+from export_jobs import atomic_output
+
+SNAPSHOT_DIR = os.path.join(CACHE_DIR, 'snapshots')
+# Bump whenever the derived state a DataEngine builds changes, so older snapshots are never loaded
+SNAPSHOT_FORMAT = 6
+MAGIC = b'LZSNAP\x01\n'
+ALIGN = 64
+# Aggregates whose values are tables or rows, looked up one key at a time: each value stays pickled in the
+# snapshot buffer until it is asked for, and only the most recently used ones are kept decoded
+LAZY_ATTRIBUTES = ('store_index', 'overview', 'article_summary', 'colorsize_index', 'week_colorsize_index',
+                   '_article_frames', '_article_inv_frames')
+LAZY_CACHE = 64
+
+def _strings(uniques, codes):
+    return np.array(uniques, dtype=object).take(codes)
+
+class _SnapshotPickler(pickle.Pickler):
+    # String columns are stored dictionary-encoded: int32 codes out of band with the numeric arrays, and
+    # each distinct string once for the whole snapshot. Loaded, a column is an array of references to
+    # those strings instead of one string object per row, so most of a mapped engine stays shared.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.strings = {}
+
+    def reducer_override(self, obj):
+        if (type(obj) is np.ndarray and obj.dtype == object and obj.ndim == 1 and len(obj)
+                and pd.api.types.infer_dtype(obj, skipna=False) == 'string'):
+            codes, uniques = pd.factorize(obj)
+            return _strings, (tuple(self.strings.setdefault(u, u) for u in uniques), codes.astype(np.int32))
+        return NotImplemented
+
+class LazyDict(Mapping):
+    # Read-only dict over values pickled one after another in a buffer; in a mapped snapshot the buffer
+    # is the shared mapping, so an instance only holds the keys and the values it has looked up lately
+    def __init__(self, keys, offsets, blob):
+        self.index = {k: i for i, k in enumerate(keys)}
+        self.offsets = offsets
+        self.blob = memoryview(blob)
+        self._value = functools.lru_cache(maxsize=LAZY_CACHE)(self._load)
+
+    @classmethod
+    def encode(cls, mapping):
+        out, offsets = io.BytesIO(), [0]
+        for value in mapping.values():
+            _SnapshotPickler(out, protocol=5).dump(value)
+            offsets.append(out.tell())
+        return cls(list(mapping), np.array(offsets, dtype=np.int64), out.getbuffer())
+
+    def _load(self, i):
+        return pickle.loads(self.blob[self.offsets[i]:self.offsets[i + 1]])
+
+    def __getitem__(self, key):
+        return self._value(self.index[key])
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __reduce_ex__(self, protocol):
+        # Protocol 5 passes the values buffer out of band, so re-encoding a mapped engine copies nothing
+        blob = pickle.PickleBuffer(self.blob) if protocol >= 5 else bytes(self.blob)
+        return LazyDict, (tuple(self.index), self.offsets, blob)
+
+def fingerprint(history, inv_history, window):
+    # Both histories are synced first, so their manifests (one stamp per source workbook) plus the pending
+    # file's stamp describe every input; a stat per workbook, no parsing, when nothing changed
+    sync_sales_history(history)
+    sync_inventory_history(inv_history)
+    try:
+        st = os.stat(PENDING_PATH)
+        pending = [st.st_mtime_ns, st.st_size]
+    except FileNotFoundError:
+        pending = None
+    inputs = [SNAPSHOT_FORMAT, window, history.manifest, inv_history.manifest, pending]
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+def snapshot_path(window, fp, directory=None):
+    # One file per fingerprint: a snapshot that is mapped by a running app is never replaced in place
+    return os.path.join(directory or SNAPSHOT_DIR, f'engine-w{window}-{fp[:24]}.snap')
+
+def encode_snapshot(engine, fp):
+    # Layout: magic, header length, JSON header, then the pickle and every numpy buffer it refers to
+    # (protocol 5, out of band), each 64-byte aligned so it can be mapped back without a copy. Chunk
+    # offsets in the header count from the first aligned byte after it. Returns the pieces in order.
+    buffers = []
+    state = {k: v for k, v in vars(engine).items() if k not in ('db', 'sql', '_frozen')}
+    for name in LAZY_ATTRIBUTES:
+        if type(state.get(name)) is dict:
+            state[name] = LazyDict.encode(state[name])
+    out = io.BytesIO()
+    _SnapshotPickler(out, protocol=5, buffer_callback=buffers.append).dump(state)
+    body = out.getbuffer()
+    chunks, offsets, pos = [], [], 0
+    for chunk in [memoryview(body), *(b.raw() for b in buffers)]:
+        pad = -pos % ALIGN
+        chunks.append(b'\0' * pad)
+        pos += pad
+        offsets.append([pos, chunk.nbytes])
+        chunks.append(chunk)
+        pos += chunk.nbytes
+    header = json.dumps({'format': SNAPSHOT_FORMAT, 'fingerprint': fp, 'window': engine.window,
+                         'created': time.time(), 'chunks': offsets}).encode()
+    head = MAGIC + struct.pack('<Q', len(header)) + header
+    return [head, b'\0' * (-len(head) % ALIGN), *chunks]
+
+def decode_snapshot(view, fp=None, db=None):
+    # The engine stored in a snapshot buffer (file map or shared memory); its arrays are views on it.
+    # None when the buffer is of another format or, if fp is given, for other inputs.
+    if bytes(view[:len(MAGIC)]) != MAGIC:
+        return None
+    (size,) = struct.unpack_from('<Q', view, len(MAGIC))
+    header = json.loads(bytes(view[len(MAGIC) + 8:len(MAGIC) + 8 + size]))
+    if header['format'] != SNAPSHOT_FORMAT or fp is not None and header['fingerprint'] != fp:
+        return None
+    base = -(-(len(MAGIC) + 8 + size) // ALIGN) * ALIGN
+    (start, length), *chunks = header['chunks']
+    state = pickle.loads(view[base + start:base + start + length],
+                         buffers=[view[base + o:base + o + n] for o, n in chunks])
+    engine = DataEngine.__new__(DataEngine)
+    vars(engine).update(state, db=db, _frozen=True)
+    if db is not None:
+        # Taken here, so the first screen query does not ingest on the Tk thread
+        engine.sql
+    return engine
+
+def write_snapshot(engine, fp, path):
+    with atomic_output(path) as tmp:
+        with open(tmp, 'wb') as f:
+            for chunk in encode_snapshot(engine, fp):
+                f.write(chunk)
+    return path
+
+def save_snapshot(engine, fp):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    return write_snapshot(engine, fp, snapshot_path(engine.window, fp))
+
+def load_snapshot(window, fp, db=None):
+    return read_snapshot(snapshot_path(window, fp), fp, db)
+
+def read_snapshot(path, fp=None, db=None):
+    # Maps the snapshot file read-only; None when it is missing or does not match
+    try:
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None
+    return decode_snapshot(memoryview(mm), fp, db)
+
+def prune_snapshots(window, keep):
+    # Removes the other snapshots of this window next to keep
+    for path in glob.glob(os.path.join(os.path.dirname(keep), f'engine-w{window}-*.snap')):
+        if path != keep:
+            try:
+                os.remove(path)
+            except OSError:
+                # Still mapped by a running app (Windows); the next prune removes it
+                pass
+
+def load_or_build(window=DEFAULT_WINDOW, db=None, save=True):
+    # The built engine for what is on disk now: mapped from its snapshot when the inputs are unchanged,
+    # otherwise built from the histories and, unless save is False, written as the new snapshot
+    return snapshot_for(window, db, save)[1]
+
+def snapshot_for(window=DEFAULT_WINDOW, db=None, save=True, build=None):
+    # (fingerprint, engine); build, when given, makes the engine for new inputs instead of a full build
+    history, inv_history = WeeklyArchive(HISTORY_DIR), WeeklyArchive(INVENTORY_HISTORY_DIR, measures=('soh',))
+    fp = fingerprint(history, inv_history, window)
+    try:
+        engine = load_snapshot(window, fp, db)
+    except Exception as e:
+        logging.error(f"Engine snapshot unreadable, rebuilding: {e}")
+        engine = None
+    if engine is not None:
+        return fp, engine
+    engine = build() if build is not None else DataEngine(window=window, history=history, inv_history=inv_history, db=db).build()
+    if save:
+        try:
+            path = save_snapshot(engine, fp)
+            prune_snapshots(window, path)
+            # Mapped back, so this process shares its pages with every one that maps the snapshot later
+            engine = read_snapshot(path, fp, db) or engine
+        except OSError as e:
+            logging.error(f"Could not save engine snapshot: {e}")
+    return fp, engine
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Prebuild the engine snapshots the app maps at startup, e.g. overnight.')
+    parser.add_argument('-n', '--window', type=int, choices=WINDOW_CHOICES, action='append',
+                        help=f'window(s) in weeks to prebuild, repeatable (default: {DEFAULT_WINDOW})')
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+    for window in args.window or [DEFAULT_WINDOW]:
+        start = time.time()
+        engine = load_or_build(window)
+        logging.info(f"{window}-week snapshot ready: {len(engine.total_qty)} articles, {len(engine.store_index)} stores "
+                     f"in {time.time() - start:.1f}s")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+import os
+import stat
+import time
+import queue
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+JOB_POLL_MS = 200
+
+class JobCancelled(Exception):
+    pass
+
+def no_progress(done, total):
+    pass
+
+# Read once at import, while no other thread can create files under the temporarily cleared umask
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def _output_mode(path):
+    # The mode of the file being replaced, or the one a plain open() would create it with
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+@contextmanager
+def atomic_output(path):
+    # Write to a temp file next to the target, then rename over it only on success. mkstemp creates the
+    # temp file private (0600), so it is given the target's mode first, or other users could not read it.
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f'.{name}.', suffix=os.path.splitext(name)[1])
+    os.close(fd)
+    try:
+        yield tmp
+        os.chmod(tmp, _output_mode(path))
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+class ExportJob:
+    def __init__(self, name, func, path):
+        self.name = name
+        self.func = func
+        self.path = path
+        self.status = 'queued'
+        self.error = None
+        self.done = 0
+        self.total = 0
+        self.started = None
+        self.cancel_event = threading.Event()
+
+    def progress(self, done, total):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        self.done, self.total = done, total
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def eta(self):
+        if not self.started or not self.done or not self.total:
+            return None
+        elapsed = time.time() - self.started
+        return elapsed / self.done * (self.total - self.done)
+
+class JobQueue:
+    # Runs export jobs one at a time on a background thread, in submission order
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = []
+        self.current = None
+        self.jobs = queue.Queue()
+        self.finished = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, name, func, path):
+        job = ExportJob(name, func, path)
+        with self.lock:
+            self.pending.append(job)
+        self.jobs.put(job)
+        return job
+
+    def busy(self):
+        with self.lock:
+            return self.current is not None or bool(self.pending)
+
+    def cancel_all(self):
+        with self.lock:
+            jobs = self.pending + ([self.current] if self.current else [])
+        for job in jobs:
+            job.cancel()
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            with self.lock:
+                self.pending.remove(job)
+                self.current = job
+            if job.cancel_event.is_set():
+                job.status = 'cancelled'
+            else:
+                job.status = 'running'
+                job.started = time.time()
+                try:
+                    with atomic_output(job.path) as tmp:
+                        job.func(tmp, job.progress)
+                    job.status = 'done'
+                except JobCancelled:
+                    job.status = 'cancelled'
+                except Exception as e:
+                    job.status = 'failed'
+                    job.error = e
+                    logging.error(f"Export '{job.name}' to {job.path} failed: {e}")
+            with self.lock:
+                self.current = None
+            self.finished.put(job)
+
+class JobPanel:
+    # Progress bar, ETA and Cancel button for a JobQueue; polled from the Tk mainloop
+    def __init__(self, parent, jobs, font=None, bg='#e3f2fd'):
+        import tkinter as tk
+        from tkinter import ttk, messagebox
+        self.messagebox = messagebox
+        self.jobs = jobs
+        self.frame = tk.Frame(parent, bg=bg)
+        self.label = tk.Label(self.frame, text='', font=font, bg=bg, fg='#1976d2')
+        self.label.pack(side='left', padx=5)
+        self.bar = ttk.Progressbar(self.frame, length=180, mode='determinate')
+        self.bar.pack(side='left', padx=5)
+        self.eta = tk.Label(self.frame, text='', font=font, bg=bg, fg='#212121')
+        self.eta.pack(side='left', padx=5)
+        self.cancel_button = ttk.Button(self.frame, text='Cancel', command=self._cancel, state='disabled')
+        self.cancel_button.pack(side='left', padx=5)
+        self.frame.after(JOB_POLL_MS, self._poll)
+
+    def pack(self, **kw):
+        self.frame.pack(**kw)
+
+    def _cancel(self):
+        job = self.jobs.current
+        if job:
+            job.cancel()
+
+    def _poll(self):
+        job = self.jobs.current
+        queued = len(self.jobs.pending)
+        if job:
+            self.label.config(text=f"{job.name}" + (f" (+{queued} queued)" if queued else ''))
+            self.bar.config(maximum=max(job.total, 1), value=job.done)
+            eta = job.eta()
+            self.eta.config(text=f"ETA {int(eta)//60}:{int(eta)%60:02d}" if eta is not None else '')
+            self.cancel_button.config(state='normal')
+        else:
+            self.label.config(text='')
+            self.bar.config(value=0)
+            self.eta.config(text='')
+            self.cancel_button.config(state='disabled')
+        while True:
+            try:
+                done = self.jobs.finished.get_nowait()
+            except queue.Empty:
+                break
+            if done.status == 'done':
+                self.messagebox.showinfo("Success", f"{done.name} saved to {done.path}")
+            elif done.status == 'failed':
+                self.messagebox.showerror("Export Failed", f"{done.name} failed: {done.error}")
+        self.frame.after(JOB_POLL_MS, self._poll)
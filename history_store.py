@@ -0,0 +1,90 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from export_jobs import atomic_output
+
+DIM_COLUMNS = ('article', 'store', 'color', 'size')
+
+def encode_week(frame, measures, dims=DIM_COLUMNS):
+    # Dimension columns are stored as int32 codes plus their distinct values; measures as plain arrays
+    arrays = {}
+    for col in dims:
+        codes, values = pd.factorize(frame[col])
+        values = np.asarray(values)
+        if values.dtype == object:
+            values = values.astype(str)
+        arrays[f'{col}_codes'] = codes.astype(np.int32)
+        arrays[f'{col}_values'] = values
+    for col in measures:
+        values = frame[col].to_numpy()
+        arrays[col] = values if values.dtype != object else pd.to_numeric(frame[col], errors='coerce').fillna(0).to_numpy()
+    return arrays
+
+def decode_week(arrays, measures, dims=DIM_COLUMNS):
+    frame = pd.DataFrame({col: arrays[f'{col}_values'][arrays[f'{col}_codes']] for col in dims})
+    for col in measures:
+        frame[col] = arrays[col]
+    return frame
+
+class WeeklyArchive:
+    # Append-only archive of weekly workbooks (sales weeks, SOH snapshots): one compressed columnar .npz
+    # partition per week, plus a manifest of the source workbook each partition came from. A partition is
+    # only rewritten when its own workbook changes, so weeks stay available after their xlsx is removed.
+    def __init__(self, root, measures=('qty', 'asp'), dims=DIM_COLUMNS):
+        self.root = root
+        self.measures = measures
+        self.dims = dims
+        self.manifest_path = os.path.join(root, 'manifest.json')
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.manifest = {}
+
+    def keys(self):
+        # Oldest first, by the order each workbook was stored with (see sync_history)
+        return sorted(self.manifest, key=lambda k: (self.manifest[k].get('order', []), k))
+
+    def _path(self, key):
+        return os.path.join(self.root, f'{key}.npz')
+
+    def stale(self, key, stamp):
+        return self.manifest.get(key, {}).get('stamp') != list(stamp)
+
+    def _save(self):
+        with atomic_output(self.manifest_path) as tmp:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.manifest, f, indent=1)
+
+    def put(self, key, frame, source, stamp, order=()):
+        os.makedirs(self.root, exist_ok=True)
+        if frame is not None:
+            with atomic_output(self._path(key)) as tmp:
+                np.savez_compressed(tmp, **encode_week(frame, self.measures, self.dims))
+        self.manifest[key] = {'source': source, 'stamp': list(stamp), 'rows': None if frame is None else len(frame),
+                              'order': list(order)}
+        self._save()
+
+    def rekey(self, keys):
+        # Moves partitions to new keys and orders, given as {key: (new_key, order)}; for archives written
+        # under an older key scheme
+        for key, (new_key, order) in keys.items():
+            entry = self.manifest.pop(key)
+            if entry['rows'] is not None:
+                os.replace(self._path(key), self._path(new_key))
+            self.manifest[new_key] = dict(entry, order=list(order))
+        if keys:
+            self._save()
+
+    def get(self, key):
+        if self.manifest[key]['rows'] is None:
+            return None
+        with np.load(self._path(key)) as arrays:
+            return decode_week(arrays, self.measures, self.dims)
+
+    def stamp(self, key):
+        return self.manifest[key]['stamp']
+
+    def source(self, key):
+        return os.path.splitext(self.manifest[key]['source'])[0]
@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+from history_store import DIM_COLUMNS
+
+# Each dimension code gets 16 bits of a cell key: article << 48 | store << 32 | color << 16 | size
+CODE_BITS = 16
+CODE_LIMIT = 1 << (CODE_BITS - 1)
+
+class Dimensions:
+    # Append-only value -> code tables shared by sales and inventory, so both address the same
+    # article/store/color/size ids. Codes never change once given out, so older snapshots stay valid.
+    def __init__(self):
+        self.values = {col: pd.Index([], dtype=object) for col in DIM_COLUMNS}
+
+    def encode(self, col, values):
+        index = self.values[col]
+        codes = index.get_indexer(values)
+        missing = codes < 0
+        if missing.any():
+            index = index.append(pd.Index(pd.unique(np.asarray(values)[missing]), dtype=object))
+            if len(index) > CODE_LIMIT:
+                raise ValueError(f"too many distinct {col} values ({len(index)})")
+            self.values[col] = index
+            codes = index.get_indexer(values)
+        return codes.astype(np.int64)
+
+    def decode(self, col, codes):
+        return self.values[col][codes]
+
+    def cell_keys(self, frame):
+        keys = np.zeros(len(frame), dtype=np.int64)
+        for col in DIM_COLUMNS:
+            keys = (keys << CODE_BITS) | self.encode(col, frame[col])
+        return keys
+
+def cell_codes(cells, col):
+    shift = CODE_BITS * (len(DIM_COLUMNS) - 1 - DIM_COLUMNS.index(col))
+    return (cells >> shift) & ((1 << CODE_BITS) - 1)
+
+def cell_totals(dims, frame, measure):
+    # Sorted distinct cell keys of a frame and the measure summed per cell
+    cells, pos = np.unique(dims.cell_keys(frame), return_inverse=True)
+    return cells, np.bincount(pos, weights=pd.to_numeric(frame[measure], errors='coerce').fillna(0).to_numpy(dtype=float), minlength=len(cells))
+
+class InventoryCube:
+    # Every SOH snapshot as one sparse article x store x color x size x week array: the sorted cell keys
+    # that ever held stock, and a cells x snapshots float32 SOH matrix. Adding a snapshot only encodes
+    # that snapshot's rows; the result is a new cube, so engines holding the old one are unaffected.
+    def __init__(self, dims, keys=(), cells=None, soh=None):
+        self.dims = dims
+        self.keys = list(keys)
+        self.cells = cells if cells is not None else np.zeros(0, dtype=np.int64)
+        self.soh = soh if soh is not None else np.zeros((0, 0), dtype=np.float32)
+
+    def added(self, key, frame):
+        new_cells, sums = cell_totals(self.dims, frame, 'soh')
+        cells = np.union1d(self.cells, new_cells)
+        soh = np.zeros((len(cells), len(self.keys) + 1), dtype=np.float32)
+        soh[np.searchsorted(cells, self.cells), :-1] = self.soh
+        soh[np.searchsorted(cells, new_cells), -1] = sums
+        return InventoryCube(self.dims, self.keys + [key], cells, soh)
+
+    def codes(self, col):
+        return cell_codes(self.cells, col)
+
+    def mask(self, **where):
+        keep = np.ones(len(self.cells), dtype=bool)
+        for col, value in where.items():
+            code = self.dims.values[col].get_indexer([value])[0]
+            keep &= self.codes(col) == code
+        return keep
+
+    def series(self, **where):
+        # SOH per snapshot for any slice, e.g. series(article='1419', store='8222-Infinity Mall Malad')
+        return self.soh[self.mask(**where)].sum(axis=0)
+
+    def totals(self, col):
+        # {value: SOH per snapshot} for one dimension, from a single bincount per snapshot
+        codes = self.codes(col)
+        size = int(codes.max()) + 1 if len(codes) else 0
+        table = np.column_stack([np.bincount(codes, weights=self.soh[:, k], minlength=size) for k in range(len(self.keys))]) if self.keys else np.zeros((size, 0))
+        present = np.unique(codes)
+        return dict(zip(self.dims.decode(col, present), table[present]))
+
+RECON_COLUMNS = ['article', 'store', 'color', 'size', 'week', 'opening', 'sold', 'closing', 'receipts']
+
+def reconcile(cube, sales, labels=None):
+    # Inferred receipts per cell and week: receipts_t = SOH_t - SOH_{t-1} + sales_t, for every pair of
+    # consecutive snapshots whose closing week has sales (sales maps a snapshot key to that week's sales
+    # frame). A negative value means stock went missing: shrink, transfers out or a data error.
+    # Everything is one matrix expression over cells x weeks; only cells with any movement are returned.
+    pairs = [t for t in range(1, len(cube.keys)) if sales.get(cube.keys[t]) is not None]
+    if not pairs:
+        return pd.DataFrame(columns=RECON_COLUMNS)
+    totals = [cell_totals(cube.dims, sales[cube.keys[t]], 'qty') for t in pairs]
+    cells = np.unique(np.concatenate([cube.cells, *(c for c, _ in totals)]))
+    soh = np.zeros((len(cells), len(cube.keys)), dtype=np.float64)
+    soh[np.searchsorted(cells, cube.cells)] = cube.soh
+    sold = np.zeros((len(cells), len(pairs)))
+    for i, (week_cells, qty) in enumerate(totals):
+        sold[np.searchsorted(cells, week_cells), i] = qty
+    closing = soh[:, pairs]
+    opening = soh[:, [t - 1 for t in pairs]]
+    receipts = closing - opening + sold
+    row, col = np.nonzero((opening != 0) | (closing != 0) | (sold != 0))
+    labels = labels or cube.keys
+    frame = pd.DataFrame({c: cube.dims.decode(c, cell_codes(cells[row], c)) for c in RECON_COLUMNS[:4]})
+    frame['week'] = np.asarray([labels[t] for t in pairs], dtype=object)[col]
+    frame['opening'], frame['sold'], frame['closing'], frame['receipts'] = opening[row, col], sold[row, col], closing[row, col], receipts[row, col]
+    return frame
+
+def shrinkage(recon, by=None):
+    # Negative inferred receipts, largest loss first; by='store' (or any dimension) totals them per value
+    loss = recon[recon['receipts'] < 0]
+    if by is not None:
+        loss = loss.groupby(by, sort=False).agg(lines=('receipts', 'size'), receipts=('receipts', 'sum')).reset_index()
+    return loss.sort_values('receipts', kind='stable').reset_index(drop=True)
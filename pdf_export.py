@@ -0,0 +1,245 @@
+import io
+import os
+import re
+import csv
+import html
+import logging
+import tempfile
+import multiprocessing
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from PIL import Image
+from data_engine import LOGO_PATH, find_image_path
+from export_jobs import atomic_output, no_progress
+from engine_snapshot import write_snapshot, read_snapshot
+
+EXPORT_WORKERS = min(8, os.cpu_count() or 1)
+STORE_PAGE_SIZE = (8.27, 11.69)
+# Resolution the thumbnails are embedded at; the text is vector
+STORE_DPI = 110
+STORE_TOP_N = 12
+STORE_GRID = (4, 3)
+STORE_ZERO_LINES = 60
+STORE_THUMB_SIZE = (160, 160)
+STORE_WEEKS_SHOWN = 5
+
+def thumbnail_png(article, size=(100, 100)):
+    return _thumbnail_png(find_image_path(article) or LOGO_PATH, size)
+
+@lru_cache(maxsize=2048)
+def _thumbnail_png(path, size):
+    img = Image.open(path)
+    img.draft('RGB', size)
+    img.thumbnail(size)
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+def figure_pdf(fig):
+    # The figure as a one-page vector PDF: text stays selectable and sharp in print, only images are rasters
+    buf = io.BytesIO()
+    fig.savefig(buf, format='pdf')
+    return buf.getvalue()
+
+class VectorPdfWriter:
+    # Joins the one-page PDFs from figure_pdf, rendered in worker processes, streamed to disk as pages
+    # arrive. A page's objects are copied renumbered past those already written; its own catalog, page
+    # tree and info are dropped. Only meant for matplotlib's output: a plain xref table, no object streams
+    # and no "N 0 R" inside strings. Objects 1 and 2 (catalog and page tree) are written by close(), once
+    # every page is known.
+    _REF = re.compile(rb'(/Parent )?\b(\d+) 0 R\b')
+    _STREAM = re.compile(rb'>>\s*stream\r?\n')
+    _DROP = re.compile(rb'/Type /(Catalog|Pages)\b')
+    _PAGE = re.compile(rb'/Type /Page\b')
+
+    def __init__(self, path):
+        self.f = open(path, 'wb')
+        self.offsets = [0, 0]
+        self.pages = []
+        self.f.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def _obj(self, body, num=None):
+        if num is None:
+            self.offsets.append(self.f.tell())
+            num = len(self.offsets)
+        else:
+            self.offsets[num-1] = self.f.tell()
+        self.f.write(b'%d 0 obj\n' % num + body + b'\nendobj\n')
+        return num
+
+    def close(self):
+        kids = b' '.join(b'%d 0 R' % p for p in self.pages)
+        self._obj(b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(self.pages)), 2)
+        self._obj(b'<< /Type /Catalog /Pages 2 0 R >>', 1)
+        xref = self.f.tell()
+        self.f.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(self.offsets)+1))
+        for off in self.offsets:
+            self.f.write(b'%010d 00000 n \n' % off)
+        self.f.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(self.offsets)+1, xref))
+        self.f.close()
+
+    def add_page(self, pdf):
+        xref = int(pdf[pdf.rindex(b'startxref')+9:].split()[0])
+        trailer = pdf.index(b'trailer', xref)
+        tokens, i, offsets = pdf[xref+4:trailer].split(), 0, {}
+        while i < len(tokens):
+            first, count = int(tokens[i]), int(tokens[i+1])
+            for k in range(count):
+                off, _, kind = tokens[i+2+3*k:i+5+3*k]
+                if kind == b'n':
+                    offsets[int(off)] = first + k
+            i += 2 + 3*count
+        info = re.search(rb'/Info (\d+) 0 R', pdf[trailer:])
+        starts = sorted(offsets)
+        bodies = {}
+        for start, end in zip(starts, starts[1:] + [xref]):
+            body = pdf[start:end]
+            body = body[body.index(b'obj')+3:body.rindex(b'endobj')].strip(b'\r\n')
+            stream = self._STREAM.search(body)
+            head = body[:stream.start()] if stream else body
+            if not self._DROP.search(head) and not (info and offsets[start] == int(info.group(1))):
+                bodies[offsets[start]] = (head, body[len(head):])
+        numbers = {old: len(self.offsets) + n for n, old in enumerate(bodies, 1)}
+        def renumber(m):
+            return b'/Parent 2 0 R' if m.group(1) else b'%d 0 R' % numbers[int(m.group(2))]
+        for head, rest in bodies.values():
+            num = self._obj(self._REF.sub(renumber, head) + rest)
+            if self._PAGE.search(head):
+                self.pages.append(num)
+
+def write_vector_pdf(path, pages):
+    with atomic_output(path) as tmp:
+        writer = VectorPdfWriter(tmp)
+        try:
+            for pdf in pages:
+                writer.add_page(pdf)
+        finally:
+            writer.close()
+
+# Per-store batch: the engine is set once in the parent and inherited by forked workers,
+# so each task only carries a store name and returns a small index row
+_ENGINE = None
+
+def _init_store_worker(engine):
+    global _ENGINE
+    _ENGINE = engine
+
+def _map_store_worker(path):
+    # Spawned workers map the engine snapshot the parent wrote, so they share its pages instead of each
+    # unpickling a private copy sent down the pipe
+    _init_store_worker(read_snapshot(path))
+
+def store_filename(store):
+    return re.sub(r'[^\w\-]+', '_', str(store)).strip('_') + '.pdf'
+
+def render_store_page(store, rank, out_dir):
+    from matplotlib.figure import Figure
+    engine = _ENGINE
+    weeks = engine.weeks
+    lines = engine.store_drilldown(store)
+    top = [line for line in lines if line[len(weeks)+1] > 0][:STORE_TOP_N]
+    zero = sorted((line for line in lines if line[len(weeks)+1] == 0 and line[len(weeks)+2] > 0), key=lambda l: -l[len(weeks)+2])
+    sold = engine.store_qty.get(store, 0)
+    soh = engine.store_soh.get(store, 0)
+
+    fig = Figure(figsize=STORE_PAGE_SIZE, dpi=STORE_DPI)
+    fig.text(0.5, 0.98, f"{store} | Lazera Shoes", ha='center', va='top', fontsize=14, weight='bold')
+    fig.text(0.5, 0.955, f"Rank #{rank}   Sales: {sold:.0f}   Revenue: ₹{engine.store_value.get(store, 0):,.0f}   SOH: {soh:.0f}   "
+             f"Zero-sale lines: {len(zero)}", ha='center', va='top', fontsize=9)
+    # Long windows only print the latest weeks per line; totals still cover the whole window
+    shown_weeks = weeks[-STORE_WEEKS_SHOWN:]
+    fig.text(0.5, 0.935, "   ".join(f"{w}: {engine.store_week_qty.get((store, w), 0):.0f}" for w in shown_weeks), ha='center', va='top', fontsize=8, color='#555555')
+
+    cols, rows = STORE_GRID
+    grid_top, grid_h = 0.92, 0.6
+    cell_w, cell_h = 1/cols, grid_h/rows
+    for i, line in enumerate(top):
+        article, week_qty, total, art_soh, sell_through = line[0], line[1:len(weeks)+1], *line[len(weeks)+1:]
+        r, c = divmod(i, cols)
+        left, bottom = c*cell_w, grid_top - (r+1)*cell_h
+        img_ax = fig.add_axes([left + 0.01, bottom + 0.03, cell_w*0.45, cell_h*0.8])
+        img_ax.imshow(Image.open(io.BytesIO(thumbnail_png(article, STORE_THUMB_SIZE))))
+        img_ax.axis('off')
+        text_x = left + cell_w*0.5
+        fig.text(text_x, bottom + cell_h*0.9, str(article), fontsize=8, weight='bold', va='top')
+        text = [f"{w}: {q:.0f}" for w, q in zip(shown_weeks, week_qty[-STORE_WEEKS_SHOWN:])] + [f"Total: {total:.0f}", f"SOH: {art_soh:.0f}", f"Sell-Thru: {sell_through:.1f}%"]
+        fig.text(text_x, bottom + cell_h*0.76, "\n".join(text), fontsize=6.5, va='top', linespacing=1.35)
+
+    zero_top = grid_top - grid_h - 0.01
+    fig.text(0.03, zero_top, "Stocked, zero sales (article: SOH)", fontsize=9, weight='bold', va='top')
+    shown = [f"{line[0]}: {line[len(weeks)+2]:.0f}" for line in zero[:STORE_ZERO_LINES]]
+    if len(zero) > STORE_ZERO_LINES:
+        shown.append(f"... +{len(zero) - STORE_ZERO_LINES} more")
+    per_col = -(-len(shown) // 4) if shown else 0
+    for c in range(4):
+        chunk = shown[c*per_col:(c+1)*per_col]
+        if chunk:
+            fig.text(0.03 + c*0.24, zero_top - 0.02, "\n".join(chunk), fontsize=6.5, va='top', linespacing=1.3, family='monospace')
+    if not shown:
+        fig.text(0.03, zero_top - 0.02, "None", fontsize=7, va='top')
+
+    name = store_filename(store)
+    write_vector_pdf(os.path.join(out_dir, name), [figure_pdf(fig)])
+    return [rank, store, sold, soh, len(lines), len(zero), name]
+
+def _prewarm_thumbnails(engine, stores):
+    # Decode every image a page will use once in the parent, so forked workers inherit a warm cache
+    articles = {line[0] for store in stores for line in engine.store_drilldown(store)[:STORE_TOP_N]}
+    with ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as pool:
+        list(pool.map(lambda a: thumbnail_png(a, STORE_THUMB_SIZE), articles))
+
+def write_index(rows, out_dir):
+    header = ['rank', 'store', 'sales', 'soh', 'articles', 'zero_sale_lines', 'file']
+    csv_path = os.path.join(out_dir, 'index.csv')
+    with atomic_output(csv_path) as tmp:
+        with open(tmp, 'w', newline='', encoding='utf-8') as f:
+            w = csv.writer(f)
+            w.writerow(header)
+            w.writerows(rows)
+    html_path = os.path.join(out_dir, 'index.html')
+    body = "\n".join(
+        f"<tr><td>{rank}</td><td><a href=\"{html.escape(name)}\">{html.escape(str(store))}</a></td><td>{sold:.0f}</td>"
+        f"<td>{soh:.0f}</td><td>{arts}</td><td>{zero}</td></tr>"
+        for rank, store, sold, soh, arts, zero, name in rows)
+    with atomic_output(html_path) as tmp:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write("<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>Store reports</title></head><body>"
+                    "<h2>Store reports | Lazera Shoes</h2><table border=\"1\" cellpadding=\"4\">"
+                    "<tr><th>Rank</th><th>Store</th><th>Sales</th><th>SOH</th><th>Articles</th><th>Zero-sale lines</th></tr>\n"
+                    f"{body}\n</table></body></html>\n")
+    return [csv_path, html_path]
+
+def write_store_pdfs(engine, out_dir, stores=None, workers=EXPORT_WORKERS, progress=no_progress):
+    stores = list(stores if stores is not None else engine.rankings(by='store'))
+    os.makedirs(out_dir, exist_ok=True)
+    # Build everything the workers read before the pool starts, so no worker recomputes it
+    for attr in ('weeks', 'store_index', 'store_qty', 'store_soh', 'store_value', 'store_week_qty'):
+        getattr(engine, attr)
+    snapshot = None
+    if 'fork' in multiprocessing.get_all_start_methods():
+        _prewarm_thumbnails(engine, stores)
+        _init_store_worker(engine)
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+    else:
+        # No fork (Windows): nothing the parent caches reaches the workers, so each decodes the
+        # thumbnails of its own pages
+        fd, snapshot = tempfile.mkstemp(suffix='.snap', prefix='store-pdfs-')
+        os.close(fd)
+        write_snapshot(engine, None, snapshot)
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_map_store_worker, initargs=(snapshot,))
+    rows = []
+    try:
+        futures = [pool.submit(render_store_page, store, rank, out_dir) for rank, store in enumerate(stores, 1)]
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                rows.append(future.result())
+            except Exception as e:
+                logging.error(f"Store report failed: {e}")
+            progress(done, len(stores))
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        _init_store_worker(None)
+        if snapshot is not None:
+            os.remove(snapshot)
+    rows.sort()
+    return write_index(rows, out_dir) + [os.path.join(out_dir, r[-1]) for r in rows]
@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import pandas as pd
+from data_engine import DataEngine, APP_ROOT, DEFAULT_WINDOW, WINDOW_CHOICES
+from export_jobs import atomic_output, no_progress
+from inventory_cube import shrinkage
+
+REPORT_DIR = os.path.join(APP_ROOT, 'reports')
+FORMATS = ('xlsx', 'csv', 'json')
+
+def article_summary(engine, week='Overall'):
+    rows = []
+    for rank, art in enumerate(engine.rankings(week), 1):
+        sm = engine.article_summary.get(art, {})
+        sold = engine.total_qty.get(art, 0) if week == 'Overall' else engine.article_week_qty.get((art, week), 0)
+        asp = engine.asp_map.get(art, 0)
+        rows.append([art, rank, *sm.get('weeks', [0]*len(engine.weeks)), sold, asp, engine.mrp_map.get(art, 0), sold*asp,
+                     sm.get('soh', 0), sm.get('pending', 0), sm.get('stores_stocked', 0), sm.get('stores_selling', 0), sm.get('zero_sale_stores', 0)])
+    return pd.DataFrame(rows, columns=['article','rank',*engine.weeks,'sales','asp','mrp','revenue','soh','pending',
+                                       'stores_stocked','stores_selling','zero_sale_stores'])
+
+def store_summary(engine, week='Overall'):
+    rows = []
+    for rank, store in enumerate(engine.rankings(week, by='store'), 1):
+        lines = engine.store_drilldown(store)
+        rows.append([store, rank, *(engine.store_week_qty.get((store, w), 0) for w in engine.weeks),
+                     engine.store_qty.get(store, 0), engine.store_value.get(store, 0), engine.store_soh.get(store, 0),
+                     len(lines), sum(1 for r in lines if r[-3] == 0 and r[-2] > 0)])
+    return pd.DataFrame(rows, columns=['store','rank',*engine.weeks,'sales','revenue','soh','articles','zero_sale_articles'])
+
+def store_articles(engine, week='Overall'):
+    rows = [(store, *line) for store in engine.rankings(week, by='store') for line in engine.store_drilldown(store)]
+    return pd.DataFrame(rows, columns=['store','article',*engine.weeks,'total','soh','sell_through'])
+
+def zero_sales(engine, week='Overall'):
+    frame = store_articles(engine, week)
+    frame = frame[(frame['total'] == 0) & (frame['soh'] > 0)]
+    return frame[['store','article','soh']].sort_values(['store','soh'], ascending=[True, False])
+
+def article_stores(engine, week='Overall'):
+    rows = [(art, *line) for art in engine.rankings(week) for line in engine.article_breakdown(art, week)['store']]
+    return pd.DataFrame(rows, columns=['article','store','qty','soh','value','trend'])
+
+def weekly_pivot(engine, week='Overall'):
+    return engine.weekly_pivot().reset_index()
+
+def store_soh_history(engine, week='Overall'):
+    cube = engine.inventory_cube
+    totals = cube.totals('store')
+    snapshots = [engine.inv_history.source(k) for k in cube.keys]
+    rows = [(store, *totals[store]) for store in sorted(totals, key=str)]
+    return pd.DataFrame(rows, columns=['store', *snapshots])
+
+def receipts(engine, week='Overall'):
+    return engine.reconciliation
+
+def shrinkage_lines(engine, week='Overall'):
+    return shrinkage(engine.reconciliation)
+
+def shrinkage_stores(engine, week='Overall'):
+    return shrinkage(engine.reconciliation, by='store')
+
+REPORTS = {
+    'article_summary': article_summary,
+    'store_summary': store_summary,
+    'store_articles': store_articles,
+    'zero_sales': zero_sales,
+    'article_stores': article_stores,
+    'weekly_pivot': weekly_pivot,
+    'store_soh_history': store_soh_history,
+    'receipts': receipts,
+    'shrinkage_lines': shrinkage_lines,
+    'shrinkage_stores': shrinkage_stores,
+}
+
+RECONCILIATION_REPORTS = ('shrinkage_stores', 'shrinkage_lines', 'receipts')
+
+def write_xlsx(frames, path):
+    # Imported here, so csv/json runs only load openpyxl (and through it Pillow) when a sales, SOH or pending
+    # workbook has to be parsed, i.e. one not in the histories in its current state; warm runs import neither
+    import openpyxl
+    wb = openpyxl.Workbook(write_only=True)
+    for name, frame in frames.items():
+        ws = wb.create_sheet(title=name[:31])
+        ws.append([str(c) for c in frame.columns])
+        for row in frame.itertuples(index=False, name=None):
+            ws.append(list(row))
+    with atomic_output(path) as tmp:
+        wb.save(tmp)
+    return [path]
+
+BREAKDOWN_SHEETS = (
+    ('store', 'Stores', ['store','qty','soh','value','trend']),
+    ('color', 'Colors', ['color','qty','pending','soh','value']),
+    ('size', 'Sizes', ['size','qty','pending','soh','value']),
+    ('detail', 'Color x Size', ['color','size','qty','pending','soh']),
+)
+
+def write_article_breakdowns(engine, articles, path, week='Overall', progress=no_progress):
+    # Rows go straight from the engine's breakdown tuples into write-only sheets, one article at a time;
+    # breakdowns are only cached for a single-article export so memory stays flat for the full catalogue
+    import openpyxl
+    wb = openpyxl.Workbook(write_only=True)
+    sheets = {}
+    for key, title, cols in BREAKDOWN_SHEETS:
+        sheets[key] = wb.create_sheet(title=title)
+        sheets[key].append(['article', *cols])
+    for n, art in enumerate(articles, 1):
+        tables = engine.article_breakdown(art, week, cache=len(articles) == 1)
+        for key, ws in sheets.items():
+            for row in tables[key]:
+                ws.append([art, *row])
+        progress(n, len(articles))
+    wb.save(path)
+
+def write_csv(frames, out_dir, stamp):
+    paths = []
+    for name, frame in frames.items():
+        path = os.path.join(out_dir, f'{name}_{stamp}.csv')
+        with atomic_output(path) as tmp:
+            frame.to_csv(tmp, index=False)
+        paths.append(path)
+    return paths
+
+def write_json(frames, out_dir, stamp):
+    paths = []
+    for name, frame in frames.items():
+        path = os.path.join(out_dir, f'{name}_{stamp}.json')
+        with atomic_output(path) as tmp:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(json.loads(frame.to_json(orient='records')), f, ensure_ascii=False, indent=1)
+        paths.append(path)
+    return paths
+
+def run(names, fmt='xlsx', out_dir=REPORT_DIR, week='Overall', engine=None, window=DEFAULT_WINDOW):
+    engine = engine or DataEngine(window=window)
+    frames = {name: REPORTS[name](engine, week) for name in names}
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = time.strftime('%Y%m%d')
+    if fmt == 'xlsx':
+        return write_xlsx(frames, os.path.join(out_dir, f'reports_{stamp}.xlsx'))
+    if fmt == 'csv':
+        return write_csv(frames, out_dir, stamp)
+    return write_json(frames, out_dir, stamp)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate Lazera sales reports without the GUI.')
+    parser.add_argument('-r', '--reports', default=','.join(REPORTS),
+                        help=f"comma separated list of reports (default: all): {', '.join(REPORTS)}")
+    parser.add_argument('-f', '--format', choices=FORMATS, default='xlsx')
+    parser.add_argument('-o', '--out', default=REPORT_DIR, help='output directory')
+    parser.add_argument('-w', '--week', default='Overall', help="week used for ranking and sales totals, e.g. 'Week 3' (default: Overall)")
+    parser.add_argument('-n', '--window', type=int, choices=WINDOW_CHOICES, default=DEFAULT_WINDOW, help='number of weeks of sales history to report on')
+    parser.add_argument('--sqlite', action='store_true', help='answer article and store queries from the SQLite mirror in history/')
+    parser.add_argument('--store-pdfs', action='store_true',
+                        help='write a one-page PDF per store plus index.csv/index.html into OUT/stores_<date> instead')
+    args = parser.parse_args(argv)
+    names = [n.strip() for n in args.reports.split(',') if n.strip()]
+    unknown = [n for n in names if n not in REPORTS]
+    if unknown:
+        parser.error(f"unknown report(s): {', '.join(unknown)}")
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+    start = time.time()
+    if args.sqlite:
+        from sales_db import SalesDatabase
+    engine = DataEngine(window=args.window, db=SalesDatabase() if args.sqlite else None)
+    if args.week != 'Overall' and args.week not in engine.weeks:
+        parser.error(f"unknown week {args.week!r}; this window has {engine.weeks[0]} to {engine.weeks[-1]}")
+    if args.store_pdfs:
+        # PIL/matplotlib are only needed for this mode
+        from pdf_export import write_store_pdfs
+        out_dir = os.path.join(args.out, f"stores_{time.strftime('%Y%m%d')}")
+        index_csv, index_html, *pdfs = write_store_pdfs(engine, out_dir, engine.rankings(args.week, by='store'))
+        logging.info(f"wrote {len(pdfs)} store reports to {out_dir}")
+        paths = [index_csv, index_html]
+    else:
+        paths = run(names, args.format, args.out, args.week, engine)
+    for path in paths:
+        logging.info(f"wrote {path}")
+    logging.info(f"done in {time.time() - start:.1f}s")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+import os
+import json
+import sqlite3
+import weakref
+import threading
+from collections import Counter
+import pandas as pd
+from data_engine import HISTORY_DIR, PENDING_PATH
+from history_store import DIM_COLUMNS
+
+SQLITE_PATH = os.path.join(HISTORY_DIR, 'sales.sqlite')
+# Bump whenever the layout below changes; a mirror in another layout is dropped and ingested again
+SCHEMA_VERSION = 3
+
+# Columns are left untyped so sizes, articles etc. keep the type they were read with, as in the frames;
+# TOTAL() is used wherever the frame path sums zero-filled (float) columns.
+# Rows belong to a part: one version of one week's (or SOH snapshot's) workbook. A part is written once and
+# never changed, so a snapshot keeps reading its own rows while a newer version of a workbook is ingested.
+# Every screen query filters on article and part first; the indexes also carry the measures, so those
+# queries are answered from the indexes alone.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS parts (part INTEGER PRIMARY KEY, tbl TEXT, key TEXT, stamp TEXT, UNIQUE (tbl, key, stamp));
+CREATE TABLE IF NOT EXISTS ingested (tbl TEXT, key TEXT, stamp TEXT, PRIMARY KEY (tbl, key));
+CREATE TABLE IF NOT EXISTS sales (part INTEGER, article, store, color, size, qty, asp);
+CREATE TABLE IF NOT EXISTS soh (part INTEGER, article, store, color, size, soh);
+CREATE TABLE IF NOT EXISTS pending (article, color, size, pending_qty, mrp);
+CREATE INDEX IF NOT EXISTS sales_article_part_store ON sales (article, part, store, color, size, qty);
+CREATE INDEX IF NOT EXISTS sales_article_color_size ON sales (article, color, size, part, store, qty);
+CREATE INDEX IF NOT EXISTS sales_part ON sales (part);
+CREATE INDEX IF NOT EXISTS soh_article_store ON soh (part, article, store, color, size, soh);
+CREATE INDEX IF NOT EXISTS soh_article_color_size ON soh (part, article, color, size, store, soh);
+CREATE INDEX IF NOT EXISTS pending_article_color_size ON pending (article, color, size, pending_qty, mrp);
+"""
+
+COLUMNS = {'sales': (*DIM_COLUMNS, 'qty', 'asp'), 'soh': (*DIM_COLUMNS, 'soh')}
+PENDING_COLUMNS = ('article', 'color', 'size', 'pending_qty', 'mrp')
+
+def file_stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+def _rows(frame, columns):
+    return zip(*(frame[c].tolist() for c in columns))
+
+class SalesDatabase:
+    # SQLite mirror of the weekly sales and SOH histories plus the pending orders. Each version of a
+    # workbook is ingested once, so a warm database only ever takes the weeks that changed, and it answers
+    # the article and store screens with indexed queries instead of per-article frames held in memory.
+    # Ingests go through the writer connection; screen queries use their own reader connection, which WAL
+    # lets read the committed parts while an ingest is running.
+    def __init__(self, path=SQLITE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self.conn.executescript(''.join(f'DROP TABLE IF EXISTS {t};' for t in ('parts', 'ingested', 'sales', 'soh', 'pending'))
+                                    + f'PRAGMA user_version = {SCHEMA_VERSION};')
+        self.conn.executescript(SCHEMA)
+        self.read_lock = threading.Lock()
+        self.reader = sqlite3.connect(path, check_same_thread=False)
+        # Parts each live snapshot reads, and those given up by snapshots since collected; released parts
+        # are only counted down by the next ingest, since a finalizer may run while this thread holds lock
+        self.refs = Counter()
+        self.released = []
+
+    def _stamps(self, tbl):
+        return dict(self.conn.execute('SELECT key, stamp FROM ingested WHERE tbl = ?', (tbl,)))
+
+    def _part(self, tbl, key, stamp, frame):
+        stamp = json.dumps(stamp)
+        row = self.conn.execute('SELECT part FROM parts WHERE tbl = ? AND key = ? AND stamp = ?', (tbl, key, stamp)).fetchone()
+        if row is not None:
+            return row[0]
+        part = self.conn.execute('INSERT INTO parts (tbl, key, stamp) VALUES (?, ?, ?)', (tbl, key, stamp)).lastrowid
+        if frame is not None:
+            columns = COLUMNS[tbl]
+            self.conn.executemany(f'INSERT INTO {tbl} VALUES ({", ".join("?" * (len(columns) + 1))})',
+                                  ((part, *row) for row in _rows(frame, columns)))
+        return part
+
+    def _prune(self):
+        # Drops parts an ingest of a newer version of the same workbook replaced, once no snapshot reads them
+        while self.released:
+            self.refs.subtract(self.released.pop())
+        replaced = self.conn.execute("""
+            SELECT part, tbl FROM parts a WHERE EXISTS
+                (SELECT 1 FROM parts b WHERE b.tbl = a.tbl AND b.key = a.key AND b.part > a.part)""").fetchall()
+        for part, tbl in replaced:
+            if self.refs[part] <= 0:
+                self.conn.execute(f'DELETE FROM {tbl} WHERE part = ?', (part,))
+                self.conn.execute('DELETE FROM parts WHERE part = ?', (part,))
+                del self.refs[part]
+
+    def snapshot(self, sales, soh):
+        # The rows of one engine snapshot, given as (key, stamp, frame) for its sales weeks and SOH
+        # snapshots: parts already ingested for that stamp are reused, the others are written from the
+        # snapshot's own frames. One transaction, so a crash mid-ingest leaves the previous state.
+        with self.lock, self.conn:
+            self._prune()
+            sales = {key: self._part('sales', key, stamp, frame) for key, stamp, frame in sales}
+            soh = {key: self._part('soh', key, stamp, frame) for key, stamp, frame in soh}
+            self.refs.update([*sales.values(), *soh.values()])
+        return SnapshotRows(self, sales, soh)
+
+    def pending(self, reader, path=PENDING_PATH):
+        # The pending workbook is only parsed when it changed since it was last stored
+        stamp = json.dumps(file_stamp(path))
+        with self.lock:
+            if self._stamps('pending').get('') == stamp:
+                return pd.read_sql_query(f'SELECT {", ".join(PENDING_COLUMNS)} FROM pending', self.conn)
+        frame = reader()
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM pending')
+            self.conn.executemany('INSERT INTO pending VALUES (?, ?, ?, ?, ?)', _rows(frame, PENDING_COLUMNS))
+            self.conn.execute("INSERT OR REPLACE INTO ingested VALUES ('pending', '', ?)", (stamp,))
+        return frame
+
+    def _query(self, sql, params):
+        with self.read_lock:
+            return self.reader.execute(sql, params).fetchall()
+
+class SnapshotRows:
+    # The parts one engine snapshot reads, by week key and SOH snapshot key, and the screen queries over
+    # them. The parts stay in the database for as long as this object lives.
+    def __init__(self, db, sales, soh):
+        self.db = db
+        self.sales = sales
+        self.soh = soh
+        weakref.finalize(self, db.released.append, [*sales.values(), *soh.values()]).atexit = False
+
+    def _parts(self, keys):
+        return [self.sales[k] for k in keys]
+
+    def article_totals(self, article, keys, snap, col):
+        # (value, qty, soh) for every store/color/size the article is stocked in, best sellers first
+        marks = ', '.join('?' * len(keys))
+        return self.db._query(f"""
+            WITH i AS (SELECT {col} AS val, SUM(soh) AS soh FROM soh WHERE part = ? AND article = ? GROUP BY {col}),
+                 s AS (SELECT {col} AS val, TOTAL(qty) AS qty FROM sales WHERE article = ? AND part IN ({marks}) GROUP BY {col})
+            SELECT i.val, COALESCE(s.qty, 0), i.soh FROM i LEFT JOIN s USING (val) ORDER BY 2 DESC, 1""",
+            (self.soh.get(snap), article, article, *self._parts(keys)))
+
+    def article_detail(self, article, keys, snap, overall=True):
+        # Color x size qty and SOH over sales rows matched to stock, plus stock with no sales when overall
+        marks = ', '.join('?' * len(keys))
+        return self.db._query(f"""
+            WITH s AS (SELECT store, color, size, qty FROM sales WHERE article = ? AND part IN ({marks})),
+                 i AS (SELECT store, color, size, soh FROM soh WHERE part = ? AND article = ?)
+            SELECT color, size, TOTAL(qty), TOTAL(soh) FROM (
+                SELECT s.color, s.size, s.qty, COALESCE(i.soh, 0) AS soh FROM s LEFT JOIN i USING (store, color, size)
+                UNION ALL
+                SELECT color, size, 0, soh FROM i WHERE ? AND NOT EXISTS
+                    (SELECT 1 FROM s WHERE s.store = i.store AND s.color = i.color AND s.size = i.size))
+            GROUP BY color, size ORDER BY color, size""",
+            (article, *self._parts(keys), self.soh.get(snap), article, overall))
+
+    def store_article(self, store, article, keys, snap):
+        # Color x size qty and SOH of one article in one store, lines with neither left out
+        marks = ', '.join('?' * len(keys))
+        return self.db._query(f"""
+            WITH s AS (SELECT color, size, SUM(qty) AS qty FROM sales WHERE article = ? AND part IN ({marks}) AND store = ? GROUP BY color, size),
+                 i AS (SELECT color, size, SUM(soh) AS soh FROM soh WHERE part = ? AND article = ? AND store = ? GROUP BY color, size)
+            SELECT color, size, TOTAL(qty), TOTAL(soh) FROM (
+                SELECT color, size, qty, 0 AS soh FROM s UNION ALL SELECT color, size, 0, soh FROM i)
+            GROUP BY color, size HAVING SUM(qty) > 0 OR SUM(soh) > 0 ORDER BY color, size""",
+            (article, *self._parts(keys), store, self.soh.get(snap), article, store))
@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from multiprocessing import shared_memory, resource_tracker
+from data_engine import HISTORY_DIR, INVENTORY_HISTORY_DIR, CACHE_DIR, DEFAULT_WINDOW, WINDOW_CHOICES
+from history_store import WeeklyArchive
+from engine_snapshot import MAGIC, fingerprint, encode_snapshot, decode_snapshot, snapshot_for
+from export_jobs import atomic_output
+
+# On Linux and macOS, segments stay in memory after the last instance exits, until the data changes or
+# `python shared_dataset.py --release`. On Windows, named segments are private to a logon session, so
+# the users of a terminal server would each publish their own; there the engine is mapped from its
+# snapshot file instead, since Windows shares the pages of one file between every session that maps it
+# (each user's, as snapshots are kept per user).
+SESSION_LOCAL = os.name == 'nt'
+
+# Which segment holds the current dataset of each window; used to release superseded segments
+SHARED_MANIFEST = os.path.join(CACHE_DIR, 'shared_memory.json')
+SEGMENT_PREFIX = 'lazera'
+
+# Segments this process has open. A segment can only be closed once no engine array still views it,
+# so superseded ones are retried whenever another segment is opened.
+_segments = {}
+
+class _Segment(shared_memory.SharedMemory):
+    # Closed by _keep once no array views it; one still viewed at exit is simply unmapped with the process
+    def __del__(self):
+        pass
+
+def segment_name(window, fp):
+    # Short enough for every platform's limit on shared memory names
+    return f'{SEGMENT_PREFIX}-w{window}-{fp[:16]}'
+
+def _open(name, size=0):
+    # Segments outlive the instance that published them (until replaced or released), so they are kept
+    # out of multiprocessing's resource tracker, which would unlink them when this instance exits
+    if sys.version_info >= (3, 13):
+        return _Segment(name, create=bool(size), size=size, track=False)
+    shm = _Segment(name, create=bool(size), size=size)
+    if os.name == 'posix':
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+def _keep(name, shm):
+    for other in [n for n in _segments if n != name]:
+        try:
+            _segments[other].close()
+        except BufferError:
+            continue
+        del _segments[other]
+    _segments[name] = shm
+
+def _decode(name, shm, fp, db):
+    engine = decode_snapshot(shm.buf.toreadonly(), fp, db)
+    if engine is not None:
+        _keep(name, shm)
+    return engine
+
+def read_manifest(path=SHARED_MANIFEST):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _unlink(name):
+    try:
+        shm = _open(name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    if os.name == 'posix' and sys.version_info < (3, 13):
+        # unlink() takes it off the tracker again
+        resource_tracker.register(shm._name, 'shared_memory')
+    # A no-op on Windows, where a segment goes away with the last instance that has it open
+    shm.unlink()
+
+def _record(window, name, fp, size, path=SHARED_MANIFEST):
+    manifest = read_manifest(path)
+    previous = manifest.get(str(window), {}).get('name')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    manifest[str(window)] = {'name': name, 'fingerprint': fp, 'size': size, 'pid': os.getpid(), 'created': time.time()}
+    with atomic_output(path) as tmp:
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=1)
+    if previous and previous != name:
+        # Instances still on the old data keep their mapping; only new ones can no longer attach to it
+        _unlink(previous)
+
+def attach(window, fp, db=None):
+    # The engine another instance published for these inputs, its arrays read-only views on the shared
+    # segment; None when there is none (yet)
+    name = segment_name(window, fp)
+    try:
+        shm = _open(name)
+    except OSError:
+        return None
+    if os.name == 'posix' and os.fstat(shm._fd).st_uid != os.getuid():
+        # Segment names are machine-wide here: one another user created is never unpickled
+        shm.close()
+        return None
+    try:
+        engine = _decode(name, shm, fp, db)
+    except Exception as e:
+        logging.error(f"Shared dataset unreadable, loading it instead: {e}")
+        engine = None
+    if engine is None:
+        # Still being written by the instance that created it, or unreadable
+        shm.close()
+    return engine
+
+def publish(engine, fp, db=None):
+    # Copies the built engine into a new segment in snapshot layout and returns the engine mapped back
+    # from it, so the publishing instance shares the same pages as every instance that attaches later.
+    # The magic goes in last: until then attaching instances see an incomplete segment and skip it.
+    chunks = [memoryview(c).cast('B') for c in encode_snapshot(engine, fp)]
+    size = sum(c.nbytes for c in chunks)
+    name = segment_name(engine.window, fp)
+    try:
+        shm = _open(name, size)
+    except FileExistsError:
+        return attach(engine.window, fp, db) or engine
+    except OSError as e:
+        logging.error(f"Could not publish the dataset to shared memory: {e}")
+        return engine
+    pos = len(MAGIC)
+    for chunk in [chunks[0][pos:], *chunks[1:]]:
+        shm.buf[pos:pos + chunk.nbytes] = chunk
+        pos += chunk.nbytes
+    shm.buf[:len(MAGIC)] = MAGIC
+    try:
+        _record(engine.window, name, fp, size)
+    except OSError as e:
+        logging.error(f"Could not update the shared memory manifest: {e}")
+    return _decode(name, shm, fp, db) or engine
+
+def attach_or_publish(window=DEFAULT_WINDOW, db=None, build=None):
+    # The engine for what is on disk now: attached when another instance already published it, otherwise
+    # built (by build, or from the engine snapshot) and published for the instances that start next
+    if SESSION_LOCAL:
+        return snapshot_for(window, db, build=build)[1]
+    history, inv_history = WeeklyArchive(HISTORY_DIR), WeeklyArchive(INVENTORY_HISTORY_DIR, measures=('soh',))
+    fp = fingerprint(history, inv_history, window)
+    engine = attach(window, fp, db)
+    if engine is not None:
+        return engine
+    fp, engine = snapshot_for(window, db, build=build)
+    return publish(engine, fp, db)
+
+def release(path=SHARED_MANIFEST):
+    # Unlinks every published segment, e.g. after all instances are closed on a machine that keeps them
+    for entry in read_manifest(path).values():
+        _unlink(entry['name'])
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Publish the datasets that app instances on this machine attach to.')
+    parser.add_argument('-n', '--window', type=int, choices=WINDOW_CHOICES, action='append',
+                        help=f'window(s) in weeks to publish, repeatable (default: {DEFAULT_WINDOW})')
+    parser.add_argument('--release', action='store_true', help='unlink the published segments instead')
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+    if args.release:
+        release()
+        return 0
+    for window in args.window or [DEFAULT_WINDOW]:
+        start = time.time()
+        engine = attach_or_publish(window)
+        logging.info(f"{window}-week dataset shared: {len(engine.total_qty)} articles, {len(engine.store_index)} stores "
+                     f"in {time.time() - start:.1f}s")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import asyncio
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from data_engine import DEFAULT_WINDOW, WINDOW_CHOICES
+from data_server import DataService, conditional_response, http_response
+
+# Local only by default; --host 0.0.0.0 opens the dashboard to the network
+WEB_HOST = '127.0.0.1'
+WEB_PORT = 8080
+WEB_WORKERS = 8
+WEB_PAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'web', 'dashboard.html')
+HEADER_LIMIT = 16 * 1024
+KEEP_ALIVE_TIMEOUT = 30
+# The API routes the page calls; the rest of the data server's API (store rows, reconciliation) stays off the dashboard
+WEB_API_ROUTES = ('meta', 'rankings', 'overview', 'articles', 'thumbnails')
+
+STATUS_TEXT = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+class Dashboard:
+    # One asyncio loop holds every browser connection (keep-alive, so a viewer costs a socket, not a
+    # thread). API requests go to a small thread pool over the shared DataService: cached responses come
+    # straight back, and a breakdown that has to be built first never stalls the other viewers.
+    def __init__(self, service, page_path=WEB_PAGE, workers=WEB_WORKERS):
+        self.service = service
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        with open(page_path, 'rb') as f:
+            page = f.read()
+        self.page = (f'"{hashlib.sha1(page).hexdigest()[:24]}"', page, 'text/html; charset=utf-8', {})
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEP_ALIVE_TIMEOUT)
+                request, *lines = head.decode('latin-1').split('\r\n')
+                method, target, version = (request.split(' ') + ['', ''])[:3]
+                headers = {}
+                for line in lines:
+                    name, _, value = line.partition(':')
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                if method not in ('GET', 'HEAD'):
+                    status, out, body = 405, {'Allow': 'GET, HEAD'}, b''
+                elif target.split('?')[0] in ('/', '/index.html'):
+                    status, out, body = conditional_response(self.page, headers)
+                elif target.startswith('/api/') and target.split('?')[0].split('/')[2] in WEB_API_ROUTES:
+                    status, out, body = await loop.run_in_executor(self.pool, http_response, self.service, target, headers)
+                else:
+                    status, out, body = 404, {'Content-Type': 'text/plain'}, b'not found'
+                close = headers.get('connection', '').lower() == 'close' or version == 'HTTP/1.0'
+                lines = [f'HTTP/1.1 {status} {STATUS_TEXT.get(status, "")}', f'Content-Length: {len(body)}',
+                         f'Connection: {"close" if close else "keep-alive"}', *(f'{k}: {v}' for k, v in out.items())]
+                writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+                if method != 'HEAD':
+                    writer.write(body)
+                await writer.drain()
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=WEB_HOST, port=WEB_PORT):
+        return await asyncio.start_server(self.handle, host, port, limit=HEADER_LIMIT)
+
+async def run(host, port, windows):
+    start = time.time()
+    dashboard = Dashboard(DataService(windows))
+    server = await dashboard.serve(host, port)
+    logging.info(f"dashboard on http://{host}:{port}/ (ready in {time.time() - start:.1f}s)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        dashboard.service.stop()
+        dashboard.pool.shutdown(wait=False, cancel_futures=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the article dashboard to web browsers.')
+    parser.add_argument('--host', default=WEB_HOST, help=f'interface to listen on (default: {WEB_HOST}, this machine only)')
+    parser.add_argument('--port', type=int, default=WEB_PORT)
+    parser.add_argument('-n', '--window', type=int, choices=WINDOW_CHOICES, action='append',
+                        help=f'window(s) in weeks to load up front, repeatable (default: {DEFAULT_WINDOW})')
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+    try:
+        asyncio.run(run(args.host, args.port, tuple(args.window or [DEFAULT_WINDOW])))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())